@@ -0,0 +1,185 @@
+""" Runs many headless simulations across a process pool and aggregates their results
+
+    python batch.py --scenario swarm --seeds 16 --ticks 1800 --set 3.hp=1,2,4 --output sweep.json
+
+Every combination of --set values is run once per seed, each run is an independent headless
+Game, and the runs are sharded over one worker process per core. Results are grouped by
+their overrides so balance sweeps and soak tests can be compared at a glance
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import traceback
+import concurrent.futures
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1') # pygame's banner would end up in the JSON on stdout
+import oQuest
+
+
+def initWorker(logLevel):
+    oQuest.log.configure(level=logLevel, consoleLevel=None) # Keep the games' log out of the JSON
+
+
+def runJob(job):
+    """ One headless simulation, returns its counters and surviving population
+    job: Dict of scenario, seed, ticks, overrides and vectorPhysics
+    """
+    result = {'job': job, 'error': None}
+    startTime = time.perf_counter()
+
+    try:
+        game = oQuest.Game(headless=True, seed=job['seed'], scenario=job['scenario'], overrides=job['overrides'],
+            vectorPhysics=job['vectorPhysics'])
+        game.run(job['ticks'])
+        population = {}
+
+        for actor in game.allSprites:
+            population[actor.template.name] = population.get(actor.template.name, 0) + 1
+
+        result['ticks'] = game.tickCount
+        result['counters'] = game.getCounters()
+        result['population'] = population
+    except BaseException as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+
+    result['elapsed'] = time.perf_counter() - startTime
+    return result
+
+
+def getJobs(scenario, seeds, ticks, sweeps, vectorPhysics=False):
+    """ One job per seed for every combination of the swept values
+    sweeps: [(id, attribute, [values])]
+    """
+    jobs = []
+
+    for values in itertools.product(*[sweep[2] for sweep in sweeps]):
+        overrides = {}
+
+        for (id, attribute, options), value in zip(sweeps, values):
+            overrides.setdefault(id, {})[attribute] = value
+
+        for seed in seeds:
+            jobs.append({'scenario': scenario, 'seed': seed, 'ticks': ticks, 'overrides': overrides,
+                'vectorPhysics': vectorPhysics})
+
+    return jobs
+
+
+def summarise(values):
+    if not values:
+        return None
+    return {'mean': sum(values) / len(values), 'min': min(values), 'max': max(values)}
+
+
+def aggregate(results):
+    """ Results grouped by overrides, with every counter and population summarised over the seeds
+    """
+    groups = {}
+
+    for result in results:
+        key = json.dumps(result['job']['overrides'], sort_keys=True)
+        groups.setdefault(key, []).append(result)
+
+    summaries = []
+
+    for key, group in groups.items():
+        completed = [result for result in group if result['error'] is None]
+        counters = set()
+        names = set()
+
+        for result in completed:
+            counters.update(result['counters'])
+            names.update(result['population'])
+
+        summaries.append({
+            'overrides': json.loads(key),
+            'runs': len(group),
+            'errors': [(result['job']['seed'], result['error']) for result in group if result['error'] is not None],
+            'elapsed': summarise([result['elapsed'] for result in completed]),
+            'ticksPerSecond': summarise([result['ticks'] / result['elapsed'] for result in completed]),
+            'counters': dict((name, summarise([result['counters'].get(name, 0) for result in completed]))
+                for name in sorted(counters)),
+            'population': dict((name, summarise([result['population'].get(name, 0) for result in completed]))
+                for name in sorted(names)),
+        })
+
+    return summaries
+
+
+def parseSweep(text):
+    """ 'ID.ATTRIBUTE=V1,V2' to (id, attribute, [values]), values are JSON where they parse as it
+    """
+    target, values = text.split('=', 1)
+    id, attribute = target.split('.', 1)
+    options = []
+
+    for value in values.split(','):
+        try:
+            options.append(json.loads(value))
+        except ValueError:
+            options.append(value)
+
+    return (id, attribute, options)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Run headless simulations across a process pool')
+    parser.add_argument('--scenario', default='default', help='Scenario from data/scenarios.json to run')
+    parser.add_argument('--seeds', type=int, default=8, help='Runs per combination of swept values')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--ticks', type=int, default=600, help='Ticks per run')
+    parser.add_argument('--set', action='append', default=[], metavar='ID.ATTRIBUTE=V1,V2',
+        help='Sweep an objects.json attribute over these values, ie. 3.hp=1,2,4')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes, one per core by default')
+    parser.add_argument('--vector-physics', action='store_true')
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--runs', action='store_true', help='Also write every run, not just the aggregates')
+    parser.add_argument('--output', help='JSON file to write, stdout if not given')
+    return parser.parse_args()
+
+
+def main():
+    arguments = parseArguments()
+    seeds = range(arguments.first_seed, arguments.first_seed + arguments.seeds)
+    jobs = getJobs(arguments.scenario, seeds, arguments.ticks, [parseSweep(text) for text in arguments.set],
+        arguments.vector_physics)
+    results = []
+    startTime = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(arguments.workers, initializer=initWorker,
+            initargs=(arguments.log_level,)) as executor:
+        for result in executor.map(runJob, jobs):
+            results.append(result)
+
+            if result['error'] is not None:
+                print('Seed {} {} failed: {}'.format(result['job']['seed'], result['job']['overrides'], result['error']),
+                    file=sys.stderr)
+
+    elapsed = time.perf_counter() - startTime
+    print('{} runs on {} workers in {:.1f}s'.format(len(jobs), arguments.workers, elapsed), file=sys.stderr)
+    output = {
+        'scenario': arguments.scenario,
+        'ticks': arguments.ticks,
+        'workers': arguments.workers,
+        'elapsed': elapsed,
+        'groups': aggregate(results),
+    }
+
+    if arguments.runs:
+        output['runs'] = results
+
+    output = json.dumps(output, indent=4)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
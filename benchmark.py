@@ -0,0 +1,183 @@
+""" Frame cost versus actor count for the real Game and Actor code paths
+
+    python benchmark.py --actors 10 100 1000 10000 --ticks 300 --output bench.json
+
+Each scenario runs a headless Game with a population of owlships, bullets and enemies
+topped up every tick, times handleInput, updateActors and drawOutput separately, and
+writes the results as JSON so runs from different commits can be compared
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None # Not available on Windows, peak RSS is reported as None
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1') # pygame's banner would end up in the JSON on stdout
+import oQuest
+
+
+# Share of the population per objects.json id: owlship, bullet, enemy
+actorMix = ((0, 'owlship', 0.01), (1, 'bullet', 0.69), (3, 'enemy', 0.30))
+phases = ('spawn', 'handleInput', 'updateActors', 'drawOutput')
+
+
+def percentile(sortedValues, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sortedValues:
+        return None
+    index = min(len(sortedValues) - 1, max(0, int(round(fraction * len(sortedValues))) - 1))
+    return sortedValues[index]
+
+
+def summarise(samples):
+    """ Milliseconds summary of a list of durations in seconds
+    """
+    samples = sorted(samples)
+    return {
+        'mean': sum(samples) / len(samples) * 1000,
+        'p50': percentile(samples, 0.50) * 1000,
+        'p95': percentile(samples, 0.95) * 1000,
+        'p99': percentile(samples, 0.99) * 1000,
+        'max': samples[-1] * 1000,
+    }
+
+
+def getCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=oQuest.rootPath,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Scenario:
+    """ One benchmark run: a fresh headless Game held at a fixed population of Actors
+    """
+    def __init__(self, actorCount, ticks, warmupTicks, vectorPhysics=False, traceMemory=False):
+        self.actorCount = actorCount
+        self.ticks = ticks
+        self.warmupTicks = warmupTicks
+        self.vectorPhysics = vectorPhysics
+        self.traceMemory = traceMemory
+        self.targets = []
+
+        for id, name, share in actorMix:
+            self.targets.append((id, name, max(1, int(round(actorCount * share)))))
+
+    def spawn(self):
+        """ Tops every type back up to its share of the population, like sustained fire would
+        """
+        game = self.game
+        counts = dict((id, 0) for id, name, count in self.targets)
+
+        for actor in game.allSprites:
+            counts[actor.attribute['id']] = counts.get(actor.attribute['id'], 0) + 1
+
+        for id, name, count in self.targets:
+            for i in range(count - counts[id]):
+                coord = [game.random.uniform(0, game.screenWidth), game.random.uniform(0, game.screenHeight), 0,
+                    game.random.uniform(-180, 180)]
+                momentum = [game.random.uniform(-3, 3), game.random.uniform(-3, 3), 0, 0]
+                game.createActor(name, id, coord, momentum)
+
+    def run(self):
+        if self.traceMemory:
+            tracemalloc.start()
+
+        self.game = oQuest.Game(headless=True, vectorPhysics=self.vectorPhysics)
+        game = self.game
+        game.setupStage()
+        timings = dict((phase, []) for phase in phases)
+        frames = []
+        actorUpdates = 0
+        clock = time.perf_counter
+
+        for tick in range(self.warmupTicks + self.ticks):
+            start = clock()
+            self.spawn()
+            spawned = clock()
+            game.handleInput([], game.noKeys)
+            handled = clock()
+            actors = len(game.awakeActors) # Sleeping Actors aren't stepped, so they don't count as updates
+            game.updateActors()
+            updated = clock()
+            game.drawOutput()
+            drawn = clock()
+            game.tickCount += 1
+
+            if tick < self.warmupTicks:
+                continue
+
+            timings['spawn'].append(spawned - start)
+            timings['handleInput'].append(handled - spawned)
+            timings['updateActors'].append(updated - handled)
+            timings['drawOutput'].append(drawn - updated)
+            frames.append(drawn - spawned) # The frame itself, topping up is benchmark overhead
+            actorUpdates += actors
+
+        peakTraced = None
+        if self.traceMemory:
+            peakTraced = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return {
+            'actors': self.actorCount,
+            'mix': dict((name, count) for id, name, count in self.targets),
+            'ticks': self.ticks,
+            'vectorPhysics': game.physics is not None,
+            'phases': dict((phase, summarise(samples)) for phase, samples in timings.items()),
+            'frame': summarise(frames),
+            'actorUpdatesPerSecond': actorUpdates / sum(timings['updateActors']),
+            'peakTracedBytes': peakTraced,
+            'peakRssKb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            'poolStats': game.actorPool.getStats(),
+        }
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Benchmark frame cost versus actor count')
+    parser.add_argument('--actors', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--ticks', type=int, default=300, help='Timed ticks per scenario')
+    parser.add_argument('--warmup', type=int, default=30, help='Untimed ticks before timing starts')
+    parser.add_argument('--vector-physics', action='store_true')
+    parser.add_argument('--tracemalloc', action='store_true', help='Also measure peak Python heap, slows the run down')
+    parser.add_argument('--output', help='JSON file to write, stdout if not given')
+    return parser.parse_args()
+
+
+def main():
+    arguments = parseArguments()
+    oQuest.log.configure(level='WARNING', consoleLevel=None) # Keep the game's log out of the JSON
+    results = {
+        'commit': getCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenarios': [],
+    }
+
+    for actorCount in arguments.actors:
+        scenario = Scenario(actorCount, arguments.ticks, arguments.warmup, arguments.vector_physics, arguments.tracemalloc)
+        result = scenario.run()
+        results['scenarios'].append(result)
+        print('{} actors: p50 {:.2f}ms p99 {:.2f}ms'.format(actorCount, result['frame']['p50'], result['frame']['p99']),
+            file=sys.stderr)
+
+    output = json.dumps(results, indent=4)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
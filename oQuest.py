@@ -5,28 +5,144 @@ import random
 #import traceback
 import string
 import json
+import bisect
+import struct
+import mmap
+import marshal
+import threading
+import time
+import argparse
+import cProfile
+import atexit
+import concurrent.futures
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import MutableMapping
+from operator import attrgetter
+from array import array
+from types import MappingProxyType
 import pygame
 from pygame.locals import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None # Vectorised physics is optional, the scalar Actor code is always available
+
+rootPath = os.path.dirname(os.path.abspath(__file__)) # So data and images load from any working directory
+
 
 class Game:
     """ Class handling the game startup, loop, and object management
     """
-    def __init__(self):
-        print('Init')
+    def __init__(self, vectorPhysics=False, prewarmTransforms=False, preloadAssets=None, headless=False, seed=0, profile=False,
+            scenario='default', overrides=None, rewindTicks=0, recordInput=False, tickRate=60, frameRate=60, pacing='fixed',
+            pixelCollisions=False, watchAttributes=False, assetCache=True, pipelined=False, vectorProjectiles=False):
+        """
+        vectorPhysics: Step all Actors' movement in one batched NumPy pass instead of per Actor
+        prewarmTransforms: Rotozoom every object's image at startup instead of on first use
+        preloadAssets: 'eager' loads every object's image before the game starts,
+            'background' loads them on a worker thread, None loads each on first spawn
+        headless: No window or display updates, for tests, CI and load runs, see run()
+        seed: Seed for self.random, anything random in the simulation has to use it to stay replayable
+        profile: Start with the frame profiler on, it can also be toggled in game with F3
+        scenario: Name of the scenario in scenarios.json that setupStage plays
+        overrides: {id: {attribute: value}} applied over objects.json, ie. for balance sweeps
+        rewindTicks: Keep a WorldSnapshot of this many past ticks, so Backspace can rewind
+        recordInput: Record every tick's input into self.inputLog, for replaying the session
+        tickRate: Simulation ticks per second, movement is scaled so the game plays at the same speed at any rate
+        frameRate: Frames drawn per second at most
+        pacing: 'fixed' draws every frame. 'adaptive' drops frames while the simulation is behind real time,
+            and draws the rest interpolated between the last two ticks
+        pixelCollisions: Check that rect-overlapping pairs' pixels overlap too before they hit, the masks
+            are built at startup and with each new image, see prewarmMasks
+        watchAttributes: Hot-reload objects.json whenever it's saved, see AttributeWatcher
+        assetCache: Load objects.json and the images from the binary AssetCache, which is rebuilt when they change
+        pipelined: Simulate each frame on a worker thread while the previous one is drawn, see SimulationPipeline
+        vectorProjectiles: Guns fire into a NumPy ProjectileBuffer instead of spawning a bullet Actor per shot
+        
+        Every Actor holds its own Game, so any number of Games can run side by side in one process
+        """
+        log.info('game', 'Init')
+        self.startupTimes = OrderedDict() # Phase: seconds, see markStartup
+        self.startupMark = time.perf_counter()
         
         self.screenWidth = 800
         self.screenHeight = 600
         self.windowTitle = 'OwlQuest: Sugoi Monogatari'
+        self.headless = headless
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.scenarioName = scenario
         
-        pygame.init()
+        if headless:
+            # Must be set before pygame.init(), the dummy drivers never open a window or audio device
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        
+        # Only the subsystems the game uses, pygame.init() would also open audio, joysticks and so on
+        # Fonts are initialised by AssetManager.getFont the first time text is drawn
+        pygame.display.init()
+        self.markStartup('pygame')
         self.setVariables()
-        self.loadAttributes() # Loads objects' attributes data
-        self.window = pygame.display.set_mode((self.screenWidth, self.screenHeight))
-        pygame.display.set_caption(self.windowTitle)
-        self.screen = pygame.display.get_surface()  
+        self.setPacing(tickRate, frameRate, pacing)
+        self.setPhysics(vectorPhysics)
+        self.vectorProjectiles = vectorProjectiles
+        self.assetCache = None
+        
+        if assetCache:
+            self.assetCache = AssetCache(self.dataPath + self.cacheFile, self.dataPath + self.objectsFile)
+        
+        self.loadAttributes(overrides) # Loads objects' attributes data
+        self.markStartup('attributes')
+        
+        if headless:
+            # pygame only has the one display, so each headless Game draws to a surface of its own
+            if pygame.display.get_surface() is None:
+                pygame.display.set_mode((1, 1)) # Images can't be converted without a display mode
+            
+            self.window = None
+            self.screen = pygame.Surface((self.screenWidth, self.screenHeight))
+        else:
+            self.window = pygame.display.set_mode((self.screenWidth, self.screenHeight))
+            pygame.display.set_caption(self.windowTitle)
+            self.screen = pygame.display.get_surface()
+        
+        self.markStartup('display')
         self.clock = pygame.time.Clock()
         self.exit = False
+        self.assets = AssetManager(cache=self.assetCache)
+        self.transforms = TransformCache()
+        self.collisions = CollisionSystem(masks=MaskCache() if pixelCollisions else None)
+        self.profiler = FrameProfiler(profile)
+        self.compositor = Compositor()
+        self.pipeline = SimulationPipeline(self) if pipelined else None
+        self.dirtyRectCount = 0
+        self.rewind = RewindBuffer(rewindTicks) if rewindTicks else None
+        self.inputLog = InputLog(seed, scenario) if recordInput else None
+        self.watcher = None
+        
+        if watchAttributes:
+            self.watcher = AttributeWatcher(self.dataPath + self.objectsFile, self.attributesList, overrides)
+        
+        if preloadAssets == 'eager':
+            self.assets.preload(self.getImageIds())
+        elif preloadAssets == 'background':
+            self.assets.preloadAsync(self.getImageIds())
+        
+        if prewarmTransforms:
+            self.prewarmTransforms()
+        
+        if pixelCollisions:
+            self.prewarmMasks()
+        
+        self.markStartup('assets')
+    
+    def markStartup(self, phase):
+        """ Times the startup phase that just finished, since the previous mark
+        """
+        now = time.perf_counter()
+        self.startupTimes[phase] = self.startupTimes.get(phase, 0) + now - self.startupMark
+        self.startupMark = now
     
     def setVariables(self):
         """ Player input move rates
@@ -37,100 +153,603 @@ class Game:
         self.zMoveRate = 0.001
         self.rRate = 0.5
         self.actorNum = 0 # Unique ID for actors
+        self.referenceTickRate = 60 # Tick rate the speeds and accelerations in objects.json are tuned for
+        self.maxFrameTime = 0.25 # Longest frame the simulation catches up on, so it can't spiral
+        self.maxFrameSkip = 4 # Frames in a row adaptive pacing may drop before it draws one anyway
+        self.tickCount = 0
+        self.noKeys = KeyState()
+        self.dataPath = os.path.join(rootPath, 'data', '')
+        self.objectsFile = 'objects.json'
+        self.scenariosFile = 'scenarios.json'
+        self.cacheFile = os.path.join('cache', 'assets.bin')
+    
+    def setPacing(self, tickRate, frameRate, pacing):
+        """ Tick and frame rates, and the per frame budget that overruns are counted against
+        """
+        self.tickRate = tickRate # Simulation updates per second, independent of the frame rate
+        self.tickLength = 1.0 / tickRate
+        self.stepScale = self.referenceTickRate / tickRate # Share of a reference tick each tick moves Actors by
+        self.frameRate = frameRate
+        self.frameBudget = 1.0 / frameRate
+        self.pacing = pacing
+        self.frameOverruns = 0 # Frames that took longer than frameBudget
+        self.framesDropped = 0 # Frames adaptive pacing didn't draw
+        self.ticksDropped = 0 # Ticks lost past maxFrameTime, when the simulation ran slower than real time
+    
+    def getTicks(self, referenceTicks):
+        """ Ticks at this tick rate that last as long as referenceTicks did at referenceTickRate
+        Every tick count in objects.json and scenarios.json goes through here once, then counts whole ticks
+        """
+        return round(referenceTicks / self.stepScale)
     
-    def main(self):
-        print('Main')
+    def setPhysics(self, vectorPhysics):
+        """ Picks the physics backend, self.physics is None for the per Actor scalar code
+        """
+        self.physics = None
+        
+        if vectorPhysics:
+            if numpy is None:
+                log.warning('physics', 'setPhysics: NumPy is not installed, falling back to scalar physics')
+            else:
+                self.physics = PhysicsWorld()
+    
+    def main(self, inputSource=None):
+        """
+        inputSource: Called with the tick number, returns (events, keys) for that tick, ie. InputLog.getInput
+            to replay a recorded session in real time, or None once it has run out, which ends the game before
+            that tick. The keyboard and mouse are used if None
+        """
+        log.info('game', 'Main')
         self.setupStage()
+        previousTime = time.perf_counter()
+        lag = 0.0 # Real time the simulation is behind by
+        events = []
+        keys = self.noKeys # Only read from the keyboard without an inputSource
+        skippedFrames = 0
         
         while self.exit == False:
-            self.handleInput(pygame.event.get(), pygame.key.get_pressed())
-            self.updateActors()
-            self.drawOutput()
-            self.clock.tick(60) # FPS
+            currentTime = time.perf_counter()
+            lag += currentTime - previousTime
+            previousTime = currentTime
+            
+            if lag > self.maxFrameTime:
+                # Too far behind to catch up, so the simulation slows down rather than spiralling
+                self.ticksDropped += int((lag - self.maxFrameTime) / self.tickLength)
+                lag = self.maxFrameTime
+            
+            if inputSource is None:
+                events.extend(pygame.event.get())
+                keys = pygame.key.get_pressed()
+            else:
+                for event in pygame.event.get():
+                    if event.type == QUIT:
+                        self.exit = True # The window can still be closed during a replay
+            
+            self.beginFrame()
+            
+            if self.pipeline is not None:
+                ticks = 0
+                while lag >= self.tickLength:
+                    ticks += 1
+                    lag -= self.tickLength
+                
+                # The frame the worker simulated while the last one was drawn, it simulates this one while that's drawn
+                frame = self.pipeline.finish()
+                
+                if not self.exit:
+                    alpha = lag / self.tickLength if self.pacing == 'adaptive' else None
+                    self.pipeline.start(ticks, events, keys, inputSource, alpha)
+                
+                if ticks:
+                    events = [] # A frame with no ticks keeps its events for the next frame that has one
+                self.drawOutput(frame=frame)
+            else:
+                # Fixed timestep, however long the frame took the simulation advances in equal ticks
+                while lag >= self.tickLength:
+                    if inputSource is not None:
+                        tickInput = inputSource(self.tickCount)
+                        
+                        if tickInput is None:
+                            self.exit = True # The replay is over, so is the game, without ticking past its end
+                            break
+                        
+                        events, keys = tickInput
+                    
+                    self.tick(events, keys)
+                    events = [] # Events are only handled by the first tick of the frame
+                    lag -= self.tickLength
+                
+                if self.pacing != 'adaptive':
+                    self.drawOutput()
+                elif time.perf_counter() - currentTime > self.frameBudget and skippedFrames < self.maxFrameSkip:
+                    # Ticking alone used up the frame, skip drawing it so the simulation keeps real-time speed
+                    skippedFrames += 1
+                    self.framesDropped += 1
+                else:
+                    skippedFrames = 0
+                    self.drawOutput(lag / self.tickLength)
+            
+            frameTime = time.perf_counter() - currentTime
+            
+            if frameTime > self.frameBudget:
+                self.frameOverruns += 1
+                log.debug('game', 'Frame overran its {:.1f}ms budget: {:.1f}ms', self.frameBudget * 1000, frameTime * 1000)
+            
+            self.endFrame()
+            self.clock.tick(self.frameRate)
+        
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        
+        log.info('game', 'Exiting')
+        log.info('game', 'Frames: {} over budget, {} dropped, {} ticks dropped', self.frameOverruns, self.framesDropped,
+            self.ticksDropped)
+        log.info('assets', 'Assets: {} hits, {} misses, {} loads from disk', self.assets.hits, self.assets.misses, self.assets.loads)
+        log.info('game', 'Actor pool: {}', self.actorPool.getStats())
+        log.flush()
+        
+    def tick(self, events, keys):
+        """ One fixed-length simulation step, the same inputs always give the same world state
+        """
+        if self.watcher is not None:
+            self.reloadAttributes()
+        
+        if self.rewind is not None:
+            self.rewind.record(self)
+        
+        if self.inputLog is not None:
+            self.inputLog.record(events, keys)
+        
+        self.handleInput(events, keys)
+        self.spawner.update(self.tickCount)
+        
+        if self.firingCount:
+            self.updateWeapons()
+        
+        if self.profiler.enabled:
+            self.profiler.mark('handleInput')
+        
+        self.updateActors()
+        self.tickCount += 1
+    
+    def updateWeapons(self):
+        """ Fires the shots of every burst that have come due, before the Actors are updated
+        Firing Actors never sleep, so they're all on the awake list
+        """
+        for actor in [actor for actor in self.awakeActors if actor.firing]:
+            actor.updateWeapons()
+    
+    def beginFrame(self):
+        if self.profiler.enabled or self.profiler.capture is not None:
+            self.profiler.beginFrame()
+    
+    def endFrame(self):
+        if self.profiler.enabled or self.profiler.capture is not None:
+            self.profiler.endFrame(self.getCounters())
+    
+    def getCounters(self):
+        """ Gauges and running totals shown by the profiler overlay
+        """
+        return {
+            'actors alive': len(self.allSprites),
+            'actors awake': len(self.awakeActors),
+            'spawns': self.actorPool.created + self.actorPool.reused,
+            'despawns': self.actorPool.released,
+            'collisions tested': self.collisions.pairsTested,
+            'mask rejects': self.collisions.maskRejects,
+            'projectiles': 0 if self.projectiles is None else self.projectiles.count,
+            'dirty rects': self.dirtyRectCount,
+            'backdrop redraws': self.backdrop.compositions,
+            'frame overruns': self.frameOverruns,
+            'frames dropped': self.framesDropped,
+        }
+    
+    def run(self, ticks, inputSource=None, render=False):
+        """ Runs ticks simulation steps as fast as the CPU allows, without the real-time loop in main()
+        inputSource: Called with the tick number, returns (events, keys) for that tick, no input if None.
+            It stops the run early by returning None, see main
+        render: Draw every tick, off-screen when headless
+        """
+        if not hasattr(self, 'allSprites'):
+            self.setupStage()
+        
+        pipeline = self.pipeline if render else None
+        
+        for i in range(ticks):
+            if pipeline is not None:
+                # Each tick is simulated on the worker while the one before it is drawn
+                frame = pipeline.finish()
+                
+                if self.exit:
+                    break
+                
+                self.beginFrame()
+                pipeline.start(1, [], self.noKeys, inputSource)
+                self.drawOutput(frame=frame)
+                self.endFrame()
+                continue
+            
+            if inputSource is None:
+                events, keys = [], self.noKeys
+            else:
+                tickInput = inputSource(self.tickCount)
+                
+                if tickInput is None:
+                    self.exit = True
+                    break
+                
+                events, keys = tickInput
+            
+            self.beginFrame()
+            self.tick(events, keys)
+            
+            if render:
+                self.drawOutput()
+            
+            self.endFrame()
+            
+            if self.exit:
+                break
         
-        print('Exiting')
+        if pipeline is not None:
+            self.drawOutput(frame=pipeline.finish()) # The last tick's frame
+    
+    def saveSnapshot(self, path):
+        with open(path, 'wb') as f:
+            f.write(WorldSnapshot.capture(self))
+    
+    def loadSnapshot(self, path):
+        """ Restores a saveSnapshot file, it has to be from the same scenario and objects.json
+        """
+        if not hasattr(self, 'allSprites'):
+            self.setupStage()
         
-    def loadAttributes(self):
+        with open(path, 'rb') as f:
+            WorldSnapshot.restore(self, f.read())
+    
+    def getWorldState(self):
+        """ Every live Actor's attributes, for comparing runs
+        """
+        return [(actor.actorNum, dict(actor.attribute)) for actor in self.allSprites]
+    
+    def loadAttributes(self, overrides=None):
         try:
-            f = open('data/objects.json', 'r')
-            self.attributesList = json.loads(f.read())
-            f.close()
+            self.attributesList = None
+            
+            if self.assetCache is not None and self.assetCache.open():
+                self.attributesList = self.assetCache.getAttributes() # Already validated when the cache was built
+            
+            if self.attributesList is None:
+                f = open(self.dataPath + self.objectsFile, 'r')
+                self.attributesList = json.loads(f.read())
+                f.close()
+            
+            for id, attributes in (overrides or {}).items():
+                self.attributesList['objects'][str(id)].update(attributes)
+            
+            self.compileTemplates()
         except IOError as e:
-            print('loadAttributes: Error loading object attributes file: {}'.format(e))
+            log.error('game', 'loadAttributes: Error loading object attributes file: {}', e)
             filePath = self.dataPath + self.objectsFile
             self.attributesList = {}
             
             if os.path.exists(self.dataPath) == False:
-                print('loadAttributes: Creating object attributes file path:{}'.format(self.dataPath))
-                os.mkdirs(self.dataPath)
+                log.warning('game', 'loadAttributes: Creating object attributes file path:{}', self.dataPath)
+                os.makedirs(self.dataPath)
             elif os.path.isfile(filePath) == False:
-                print('loadAttributes: Touching object attributes file:{}'.format(self.objectsFile))
-                f = open(self.objectsFile, 'w')
+                log.warning('game', 'loadAttributes: Touching object attributes file:{}', self.objectsFile)
+                f = open(filePath, 'w')
                 f.close()
         except BaseException as e:
-            print('loadAttributes: Error loading object attributes file: {}'.format(e))
+            log.error('game', 'loadAttributes: Error loading object attributes file: {}', e)
+        
+    def prewarmTransforms(self):
+        """ Fills the transform cache with every rotation of each object's image at its starting scale
+        """
+        for attribute in self.attributesList['objects'].values():
+            image = self.assets.getImage(attribute['imageId'])
+            self.transforms.prewarm(attribute['imageId'], image, attribute.get('s', 1))
         
+        if self.collisions.masks is not None:
+            self.collisions.masks.prewarm(self.transforms)
+        
+        log.info('assets', 'prewarmTransforms: {} images cached', len(self.transforms.entries))
+    
+    def prewarmMasks(self):
+        """ Builds the narrowphase's mask of every rotation of each type that collides, at its starting scale,
+        so the collision loop only looks them up. Scales an Actor grows or shrinks to later get theirs in
+        Actor.updateImage, when the image itself is made
+        """
+        masks = self.collisions.masks
+        layers = set()
+        
+        for template in self.templates.values():
+            layers.update(getattr(template, 'collidesWith', ()))
+        
+        for template in self.templates.values():
+            if getattr(template, 'collidesWith', ()) or getattr(template, 'collisionLayer', None) in layers:
+                image = self.assets.getImage(template.imageId)
+                self.transforms.prewarm(template.imageId, image, getattr(template, 's', 1))
+                masks.add((template.imageId, None, None), image) # Actors not drawn yet, see MaskCache.get
+        
+        masks.prewarm(self.transforms)
+        log.info('assets', 'prewarmMasks: {} masks cached', len(masks.entries))
+    
+    def getImageIds(self):
+        """ Every imageId referenced in objects.json
+        """
+        return sorted(set(attribute['imageId'] for attribute in self.attributesList['objects'].values()))
+    
     def getAttributes(self, id):
         """
         For Actors to get a set of object attributes from an already loaded attributes list
         We only have to load the list once this way
         """
         return self.attributesList["objects"][str(id)]
+    
+    def compileTemplates(self):
+        """ One shared, immutable ActorTemplate per object type in objects.json
+        """
+        self.templates = {}
+        
+        for id, attributes in self.attributesList['objects'].items():
+            self.templates[int(id)] = ActorTemplate(attributes)
+    
+    def getTemplate(self, id):
+        return self.templates[int(id)]
+    
+    def reloadAttributes(self):
+        """ Swaps in the templates of every type the AttributeWatcher saw change
+        Only Actors of those types are touched, and they keep their state
+        """
+        changes = self.watcher.poll()
+        
+        if changes is None:
+            return
+        
+        self.attributesList, templates = changes
+        self.templates.update(templates)
+        
+        if self.projectiles is not None:
+            self.projectiles.setTemplates(templates)
+        actors = list(self.allSprites)
+        updated = 0
+        
+        for freeActors in self.actorPool.freeActors.values():
+            actors.extend(freeActors) # So they respawn as the new version
+        
+        for actor in actors:
+            template = templates.get(actor.template.id)
+            
+            if template is not None:
+                actor.setTemplate(template)
+                updated += 1
+            
+            for attachment in actor.attachmentList:
+                template = templates.get(attachment.template.id)
+                
+                if template is not None:
+                    attachment.setTemplate(template)
+                    updated += 1
+        
+        log.info('game', 'reloadAttributes: Reloaded types {}, {} Actors updated', sorted(templates), updated)
         
+    def loadScenario(self, name):
+        """ A scenario from scenarios.json: its starting actors and its spawn waves
+        """
+        try:
+            f = open(self.dataPath + self.scenariosFile, 'r')
+            scenario = json.loads(f.read())['scenarios'][name]
+            f.close()
+        except BaseException as e:
+            log.error('game', 'loadScenario: Error loading scenario {}: {}', name, e)
+            # Debug stage, what setupStage always played before there were scenarios
+            scenario = {
+                'actors': [{'name': 'player', 'id': 0, 'coord': [0, 0, 0, 0]}, {'name': 'enemy', 'id': 3, 'coord': [50, 50, 0, 0]}],
+                'waves': [],
+            }
+        
+        return scenario
+    
     def setupStage(self):
-        self.createBackground()
+        self.startupMark = time.perf_counter() # Time spent between __init__ and here isn't startup
+        scenario = self.loadScenario(self.scenarioName)
+        self.createBackground(scenario.get('layers'))
         self.spritesInitDetails = list()
-        self.spritesInitDetails.append(('player', 0, [0, 0, 0, 0]))
-        self.spritesInitDetails.append(('enemy', 3, [50, 50, 0, 0])) # Debug enemy
+        
+        for actor in scenario['actors']:
+            self.spritesInitDetails.append((actor['name'], actor['id'], actor['coord']))
+        
+        self.spawner = WaveSpawner(self, scenario['waves'], self.tickCount)
         self.allSprites = []
-        self.allSpritesGroup = pygame.sprite.RenderUpdates()
+        self.actorHandles = {} # actorNum: Actor, for looking up live Actors by a stable handle
+        self.awakeActors = [] # Actors updated every tick, resting ones sleep until something wakes them
+        self.destroyedActors = [] # Destructed this tick, compactActors removes them after the update
+        self.restingActors = [] # Going to sleep this tick, also applied by compactActors
+        self.screenRect = pygame.Rect(0, 0, self.screenWidth, self.screenHeight)
+        self.actorPool = ActorPool()
+        self.depths = DepthBuckets()
+        self.firingCount = 0 # Guns part way through a burst
+        self.projectiles = None
+        
+        if self.vectorProjectiles:
+            if numpy is None:
+                log.warning('physics', 'setupStage: NumPy is not installed, guns fire bullet Actors instead')
+            else:
+                self.projectiles = ProjectileBuffer(self.transforms, self.assets, self.getTicks)
         
         for sprite in self.spritesInitDetails:
             # Create sprite objects: name, id(type), starting coordinates
-            print(sprite)
+            log.debug('game', 'setupStage: {}', sprite)
             self.createActor(sprite[0], sprite[1], sprite[2])
         
-        pygame.display.flip()
+        if not self.headless:
+            pygame.display.flip()
+        
+        self.markStartup('stage')
+        log.info('game', 'Startup took {:.1f}ms: {}', sum(self.startupTimes.values()) * 1000,
+            ', '.join('{} {:.1f}ms'.format(phase, seconds * 1000) for phase, seconds in self.startupTimes.items()))
     
-    def createBackground(self):
-        self.background = pygame.Surface((self.screenWidth, self.screenHeight))
-        self.background.fill((128, 128, 128))
-        self.screen.blit(self.background, (0,0))
+    def createBackground(self, layers=None):
+        """ Pre-renders the scenario's backdrop layers, the grey title screen if it has none
+        layers: Layer dicts from scenarios.json, back to front
+        """
+        if layers is None:
+            layers = [
+                {'type': 'fill', 'color': [128, 128, 128]},
+                {'type': 'text', 'text': 'OwlQuest: Sugoi Monogatari', 'size': 36, 'color': [10, 10, 10]},
+            ]
         
-        if pygame.font:
-            font = pygame.font.Font(None, 36)
-            text = font.render("OwlQuest: Sugoi Monogatari", 1, (10, 10, 10))
-            textPos = text.get_rect(centerx=self.screen.get_width()/2)
-            self.screen.blit(text, textPos)
+        size = (self.screenWidth, self.screenHeight)
+        self.backdrop = Backdrop(size, [Backdrop.createLayer(size, layer) for layer in layers])
+        self.background = self.backdrop.surface # What the Compositor clears from, recomposited in place
+        self.screen.blit(self.background, (0,0))
     
     def createActor(self, name, id, coord, momentum=[0,0,0,0]):
-        print('Creating actor')
+        """ Spawns an Actor, reusing a destroyed one of the same type if the pool has one
+        Returns the Actor's handle for getActor
+        """
+        log.debug('actor', 'Creating actor {} {}', name, id)
         actorIndex = len(self.allSprites)
-        newActor = Actor(self.actorNum, actorIndex, name, id, coord, momentum)
-        #self.allSprites[self.actorNum] = newActor
+        newActor = self.actorPool.acquire(id)
+        
+        if newActor is None:
+            newActor = Actor(self, self.actorNum, actorIndex, name, id, coord, momentum)
+        else:
+            newActor.respawn(self.actorNum, actorIndex, coord, momentum)
+        
         self.allSprites.append(newActor)
-        self.allSpritesGroup.add(newActor)
+        self.addActor(name, newActor)
+        self.wakeActor(newActor)
+        return newActor.actorNum
+    
+    def spawnBatch(self, name, id, coords, momenta=None):
+        """ createActor for a whole wave of one type
+        With vectorPhysics, PhysicsWorld places the whole wave in one write per column, instead of a write per Actor and field
+        momenta: One momentum per coord, or None for all at rest
+        Returns the new Actors' handles
+        """
+        rows = [None] * len(coords)
+        
+        if self.physics is not None:
+            rows = self.physics.allocateBatch(self.getTemplate(id).defaults, coords, momenta)
+        
+        acquire = self.actorPool.acquire
+        actorIndex = len(self.allSprites)
+        awakeIndex = len(self.awakeActors)
+        newActors = []
+        
+        for i, coord in enumerate(coords):
+            momentum = [0, 0, 0, 0] if momenta is None else momenta[i]
+            newActor = acquire(id)
+            
+            if newActor is None:
+                newActor = Actor(self, self.actorNum, actorIndex, name, id, coord, momentum, rows[i])
+            else:
+                newActor.respawn(self.actorNum, actorIndex, coord, momentum, rows[i])
+            
+            newActor.awakeIndex = awakeIndex
+            newActors.append(newActor)
+            self.addActor(name, newActor)
+            actorIndex += 1
+            awakeIndex += 1
+        
+        self.allSprites.extend(newActors)
+        self.awakeActors.extend(newActors)
+        log.debug('actor', 'Spawned {} {} {}', len(newActors), name, id)
+        return [actor.actorNum for actor in newActors]
+    
+    def addActor(self, name, newActor):
+        # What createActor and spawnBatch both do for each Actor, apart from putting it on the lists
+        self.actorHandles[self.actorNum] = newActor
+        self.depths.add(newActor)
         
         if name == 'player':
-            self.playerSprite = self.allSprites[-1]
-            #self.playerSprite = self.allSprites[self.actorNum]
+            self.playerSprite = newActor
         
         self.actorNum += 1
     
+    def getActor(self, handle):
+        """ The live Actor with this handle, or None once it's destroyed
+        """
+        return self.actorHandles.get(handle)
+    
+    def wakeActor(self, actor):
+        """ Puts a sleeping Actor back on the per-tick update list
+        """
+        actor.restTicks = 0
+        
+        if actor.awakeIndex is None:
+            actor.awakeIndex = len(self.awakeActors)
+            self.awakeActors.append(actor)
+    
+    def sleepActor(self, actor):
+        """ Takes an Actor off the per-tick update list, it stays drawn and collidable
+        """
+        index = actor.awakeIndex
+        
+        if index is None:
+            return
+        
+        # Swap-remove, like allSprites
+        lastActor = self.awakeActors.pop()
+        if lastActor is not actor:
+            self.awakeActors[index] = lastActor
+            lastActor.awakeIndex = index
+        
+        actor.awakeIndex = None
+    
+    def compactActors(self):
+        """ The last stage of the tick, takes every Actor destructed this tick out of the world and
+        every Actor that came to rest off the update list, so nothing changes the lists while they're updated
+        """
+        if self.restingActors:
+            for actor in self.restingActors:
+                self.sleepActor(actor)
+            self.restingActors = []
+        
+        if self.destroyedActors:
+            destroyedActors = self.destroyedActors
+            self.destroyedActors = []
+            
+            for actor in destroyedActors:
+                actor.resetWeapons()
+                actor.removeAttachments()
+                self.deleteActor(actor)
+    
     def deleteActor(self, actorObject):
-        #del self.allSprites[actorNum]
-        #x = len(self.allSprites)
+        index = actorObject.actorIndex
+        
+        if index is None:
+            return # Already destroyed this tick
+        
         try:
-            print('Destroying {}'.format(actorObject))
-            actorObject.remove(self.allSpritesGroup)
-            self.allSprites.remove(actorObject)
+            log.debug('actor', 'Destroying {} {}', actorObject.template.name, actorObject.actorNum)
+            
+            # Swap-remove, the last Actor takes over the destroyed one's slot
+            lastActor = self.allSprites.pop()
+            if lastActor is not actorObject:
+                self.allSprites[index] = lastActor
+                lastActor.actorIndex = index
+            
+            actorObject.actorIndex = None
+            self.sleepActor(actorObject)
+            self.depths.remove(actorObject)
+            del self.actorHandles[actorObject.actorNum]
+            
+            if actorObject.physicsRow is not None:
+                self.physics.release(actorObject.physicsRow)
+                actorObject.physicsRow = None
+            
+            self.actorPool.release(actorObject)
         except BaseException as e:
-            print('Game: deleteActor: Error deleting Actor {}: {}'.format(actorObject, e))
-        #print('{} {}'.format(x, len(self.allSprites))
+            log.error('actor', 'Game: deleteActor: Error deleting Actor {}: {}', actorObject.actorNum, e)
     
     def handleInput(self, events, key):
         # Pump syncs pygame's event handler with states of input devices
-        pygame.event.pump()
+        # Pipelined, this runs on the simulation thread, and only the main thread may touch the event queue
+        if self.pipeline is None:
+            pygame.event.pump()
         
         kAddEngine = pygame.K_w
         kMinEngine = pygame.K_s
@@ -147,6 +766,9 @@ class Game:
         kFire = pygame.MOUSEBUTTONDOWN
         kReset = pygame.K_RETURN
         kQuit = pygame.K_ESCAPE
+        kProfile = pygame.K_F3
+        kCaptureProfile = pygame.K_F4
+        kRewind = pygame.K_BACKSPACE
         
         # self.playerSprite is the player object, move(x, y, z, rotation)
         # Y-Axis
@@ -204,9 +826,15 @@ class Game:
                 self.exit = True
             elif event.type == KEYDOWN:
                 if event.key == kReset:
-                    self.allSprites[0].reset()
+                    self.playerSprite.reset()
                 elif event.key == kQuit:
                     self.exit = True
+                elif event.key == kProfile:
+                    self.profiler.toggleOverlay()
+                elif event.key == kCaptureProfile:
+                    self.profiler.startCapture()
+                elif event.key == kRewind and self.rewind is not None:
+                    self.rewind.rewind(self, self.tickRate) # A second back
             elif event.type == kFire: #pygame.MOUSEBUTTONDOWN:# and event.button == LEFT:
                 self.playerSprite.fire()
             else:
@@ -214,73 +842,292 @@ class Game:
                 pass
     
     def updateActors(self):
-        for actor in self.allSprites:
-            actor.update()
-            #self.screen.blit(pygame.transform.rotozoom(actor.image(), actor.pos()['r'], actor.pos()['s']), actor.rectangle())
+        if self.profiler.enabled:
+            self.updateActorsProfiled(self.profiler)
+            return
+        
+        # Staged: damage from every collision is applied first, then Actors are updated, and only then
+        # are destroyed and resting ones taken off the lists. So nothing is removed while it's iterated
+        # Sleeping Actors are still targets, anything hitting one wakes it before the update below
+        self.collisions.resolve(self.allSprites, self.projectiles)
+        
+        if self.physics is None:
+            for actor in self.awakeActors:
+                actor.update()
+        else:
+            # Same per Actor order as Actor.update, but the movement of every Actor is stepped at once
+            for actor in self.awakeActors:
+                actor.updateState()
+            
+            self.physics.step(self.screenWidth, self.screenHeight, self.stepScale)
+            
+            for actor in self.awakeActors:
+                if not actor.destroyed:
+                    actor.updateOutput()
+        
+        if self.projectiles is not None:
+            self.projectiles.step(self.screenWidth, self.screenHeight, self.stepScale)
+        
+        self.compactActors()
     
-    def drawOutput(self):
-        self.allSpritesGroup.clear(self.screen, self.background)
+    def updateActorsProfiled(self, profiler):
+        """ updateActors with every step timed, kept separate so the normal path pays nothing for it
+        """
+        self.collisions.resolve(self.allSprites, self.projectiles)
+        profiler.mark('collisions')
+        
+        for actor in self.awakeActors:
+            actor.updateStateProfiled(profiler)
+            
+            if self.physics is None and not actor.destroyed:
+                actor.updatePhysics()
+                profiler.mark('Actor.updatePhysics')
+        
+        if self.physics is not None:
+            self.physics.step(self.screenWidth, self.screenHeight, self.stepScale)
+            profiler.mark('PhysicsWorld.step')
+        
+        for actor in self.awakeActors:
+            if not actor.destroyed:
+                actor.updateOutputProfiled(profiler)
+            #self.screen.blit(pygame.transform.rotozoom(actor.image(), actor.pos()['r'], actor.pos()['s']), actor.rectangle())
+        
+        if self.projectiles is not None:
+            self.projectiles.step(self.screenWidth, self.screenHeight, self.stepScale)
+            profiler.mark('ProjectileBuffer.step')
         
-        # Only update changed areas for speed
-        dirty = self.allSpritesGroup.draw(self.screen)
-        pygame.display.update(dirty)
+        self.compactActors()
+        profiler.mark('compactActors')
     
-        # flip has something to do with HW acceleration
-        #pygame.display.flip()
-        #pygame.display.update()
+    def drawOutput(self, alpha=None, frame=None):
+        """
+        alpha: How far from the previous tick to the last one to draw moving Actors, None draws them as they are
+        frame: A FrameBuffer to draw instead of the Actors, which the SimulationPipeline is already moving on
+        """
+        profiler = self.profiler
+        overlays = []
+        
+        if profiler.overlay:
+            overlays.append((profiler.getOverlay(), (0, 0)))
+        
+        if frame is not None:
+            layers = frame.layers # Already interpolated by the worker
+            tickCount = frame.tickCount
+        else:
+            if alpha is not None:
+                # Only sleeping Actors are sure not to have moved since the previous tick
+                for actor in self.awakeActors:
+                    if actor.visible:
+                        actor.interpolateRect(alpha)
+            
+            layers = self.depths.getLayers()
+            tickCount = self.tickCount
+            
+            if self.projectiles is not None:
+                # Over the Actors, in one batch per rotated image
+                layers.append(self.projectiles.getBlits(self.screenRect, alpha))
+        
+        # Only update changed areas for speed, and skip Actors culled as off-screen
+        # The whole screen is only redrawn when a backdrop layer scrolled onto a new pixel
+        redraw = self.backdrop.update(tickCount * self.stepScale)
+        dirty = self.compositor.draw(self.screen, self.background, layers, overlays, redraw)
+        
+        if frame is None and alpha is not None:
+            # The simulation and collisions carry on from the real positions
+            for actor in self.awakeActors:
+                actor.updateRect()
+        
+        if profiler.enabled:
+            profiler.mark('drawOutput')
+        
+        if self.headless:
+            self.dirtyRectCount = len(dirty)
+        else:
+            # The one display update of the frame, a flip if most of the screen changed anyway
+            self.dirtyRectCount = self.compositor.present(dirty, self.screenWidth * self.screenHeight)
+            
+            if profiler.enabled:
+                profiler.mark('display.update')
 
 
 
 class Actor(pygame.sprite.Sprite):
     """ Class for objects in the game: player, enemies, bullets
     """
-    def __init__(self, actorNum, actorIndex, name, id, coord=[0,0,0,0], momentum=[0,0,0,0]):
+    sleepTicks = 2 # Ticks at rest before an Actor leaves the per-tick update list
+    
+    def __init__(self, game, actorNum, actorIndex, name, id, coord=[0,0,0,0], momentum=[0,0,0,0], physicsRow=None):
         """
+        game: The Game this Actor lives in
         actorNum: Unique ID for created Actors
         actorIndex: Position of Actor in game's allSprites list
         name: Debug use
         id: Actor attributes to load
         coord: Initialisation coordinates
         momentum: Initialisation momentum
+        physicsRow: A row PhysicsWorld.allocateBatch already placed it in, see Game.spawnBatch
         """
         # Do I want to keep all the attributes here, or move them into ActorAttachments?
         #try:
+        self.game = game
         self.actorNum = actorNum
         self.actorIndex = actorIndex
+        self.awakeIndex = None # Position in game's awakeActors list, None while asleep
+        self.restTicks = 0 # Consecutive ticks spent at rest
+        self.destroyed = False # Destructed, and waiting for Game.compactActors to remove it
+        self.visible = True # False while culled as off-screen
+        self.physicsRow = None
+        self.depthBand = None # Band of game's DepthBuckets this Actor is drawn in
+        self.depthZ = None # z the band was picked for
+        self.firing = 0 # Attachments part way through a burst, see ActorAttachment.fire
         pygame.sprite.Sprite.__init__(self) # Call sprite initialiser
-        self.loadAttributes(id) # Load object attributes from JSON file
+        self.loadAttributes(id, physicsRow) # Load object attributes from JSON file
+        
+        if physicsRow is None:
+            self.setCoordinates(coord, momentum)
+        
         self.setImage()
         self.setRect()
-        self.setVariables(coord, momentum)
+        self.setVariables()
+        self.setTimers()
         self.setDefaultAttachments()
         self.attribute['loaded'] == True
         #except BaseException as e:
             #print('Actor.__init__: Error creating object: {}'.format(e))
     
-    def loadAttributes(self, id):
-        self.attribute = self.getAttributes(id)
-    
-    def getAttributes(self, id):
-        # Ideally we don't use game but some form of super() to access getAttributes
-        return game.getAttributes(id).copy() # Dicts are passed by reference
+    def loadAttributes(self, id, physicsRow=None):
+        # The type's static attributes are shared, only the ones that change get a per-Actor copy
+        self.template = self.game.getTemplate(id)
+        
+        if self.game.physics is None:
+            self.attribute = ActorState(self.template)
+        else:
+            self.attribute = PhysicsActorState(self.template, self.game.physics, physicsRow)
+            self.physicsRow = self.attribute.row
     
     def createAttachment(self, id, name, coord):
-        newAttachment = ActorAttachment(id, name, coord)
+        if not self.attachmentList:
+            self.ownImage()
+        
+        newAttachment = ActorAttachment(self.game, id, name, coord, self)
         self.attachmentList.append(newAttachment)
         self.attachmentGroup.add(newAttachment)
+        self.compositeDirty = True
+    
+    def ownImage(self):
+        # Attachments are composited onto self.surface, so stop sharing the AssetManager's image
+        self.cleanImage = self.surface # Without attachments, the composite is rebuilt from it
+        self.surface = self.surface.copy()
+        self.image = self.surface
+        self.baseImage = self.surface
+        self.compositeDirty = True
+    
+    def updateComposite(self):
+        """ Rebuilds the cached image of this Actor with its attachments drawn on, only after one changed
+        Between changes the Actor costs what a single sprite does, one cached rotozoom of the composite
+        """
+        self.compositeDirty = False
+        
+        for attachment in self.attachmentList:
+            attachment.update()
+        
+        self.surface = self.cleanImage.copy()
+        Compositor.blitSprites(self.surface, self.attachmentList)
+        self.baseImage = self.surface
+        self.transformKey = None # So updateImage rotozooms the new composite
+        self.mask = None
+    
+    def getBaseSize(self):
+        # Size of the image attachments are placed on
+        return self.cleanImage.get_size()
+    
+    def getWorldTransform(self):
+        """ (x, y, z, r, s) of the centre of the Actor as drawn, the root of its attachments' transforms
+        """
+        state = self.attribute
+        return (state.x + self.image.get_width() / 2, state.y + self.image.get_height() / 2, state.z, state.r, state.s)
     
-    def setVariables(self, coord, momentum):
-        self.attribute['x'] = coord[0]
-        self.attribute['y'] = coord[1]
-        self.attribute['z'] = coord[2]
-        self.attribute['r'] = coord[3]
-        self.attribute['xs'] = momentum[0]
-        self.attribute['ys'] = momentum[1]
-        self.attribute['zs'] = momentum[2]
-        self.attribute['rs'] = momentum[3]
+    def setTemplate(self, template):
+        """ Swaps in a reloaded version of this Actor's type, keeping its state
+        """
+        imageChanged = template.imageId != self.template.imageId
+        self.template = template
+        self.attribute.template = template
+        
+        if 'ttl' in template.defaults and not self.expires:
+            self.attribute.ttl = self.game.getTicks(template.ttl)
+        self.expires = 'ttl' in template.defaults
+        
+        if self.physicsRow is not None:
+            self.game.physics.setLimits(self.physicsRow, template.defaults)
+        
+        if imageChanged:
+            self.setImage()
+            self.rect.size = self.surface.get_size()
+            
+            if self.attachmentList:
+                self.ownImage()
+                self.updateComposite()
+            
+            self.updateImage()
+        
+        self.wake() # New limits or friction can move a resting Actor
+    
+    def setVariables(self):
         self.attachmentList = []
         self.attachmentGroup = pygame.sprite.RenderUpdates()
     
+    def setCoordinates(self, coord, momentum):
+        state = self.attribute
+        state.x = coord[0]
+        state.y = coord[1]
+        state.z = coord[2]
+        state.r = coord[3]
+        state.xs = momentum[0]
+        state.ys = momentum[1]
+        state.zs = momentum[2]
+        state.rs = momentum[3]
+    
+    def respawn(self, actorNum, actorIndex, coord, momentum, physicsRow=None):
+        """ Resets a pooled Actor to a fresh copy of its type, keeping its image and attachments
+        physicsRow: As for __init__
+        """
+        self.actorNum = actorNum
+        self.actorIndex = actorIndex
+        imageFile = self.attribute.image
+        
+        if self.game.physics is not None:
+            self.physicsRow = self.game.physics.allocate(self.template.defaults) if physicsRow is None else physicsRow
+            self.attribute.row = self.physicsRow
+        
+        self.attribute.reset()
+        self.attribute.image = imageFile
+        self.setTimers()
+        
+        if physicsRow is None:
+            self.setCoordinates(coord, momentum)
+        
+        self.updateRect()
+        self.previousPosition = self.rect.topleft
+        self.destroyed = False
+        self.restTicks = 0
+        self.visible = True
+        self.attachmentGroup.add(self.attachmentList)
+    
+    def setTimers(self):
+        # objects.json counts these in reference ticks, from here they count down once a tick
+        self.attribute.primerTicks = self.game.getTicks(self.template.primerTicks)
+        self.expires = 'ttl' in self.template.defaults # Destroyed once its ttl runs out, see setLifetime
+        
+        if self.expires:
+            self.attribute.ttl = self.game.getTicks(self.template.ttl)
+    
+    def setLifetime(self, ticks):
+        """ Destroys the Actor ticks ticks from now, whether or not its type has a ttl, ie. for a gun's bullets
+        """
+        self.expires = True
+        self.attribute.ttl = ticks
+    
     def setDefaultAttachments(self):
         # Move to external data file
         if self.attribute['id'] == 0:
@@ -288,17 +1135,21 @@ class Actor(pygame.sprite.Sprite):
             self.createAttachment(2, 'gun', (50,50,0))
     
     def setImage(self):
-        self.actorsImagePath = 'i/Actors'
         imageId = self.attribute['imageId']
-        self.attribute['image'] = '{}/{}.png'.format(self.actorsImagePath, imageId)
-        self.image = pygame.image.load(self.attribute['image']).convert_alpha()
+        self.attribute['image'] = self.game.assets.getImageFile(imageId)
+        self.image = self.game.assets.getImage(imageId) # Shared with every other Actor using this image
         self.baseImage = self.image
         self.surface = self.image
+        self.transformKey = None # Rotation and scale self.image was last transformed to
+        self.compositeDirty = False # An attachment changed since the composite was drawn
+        self.mask = None # Only used with attachments, see MaskCache.get
+        self.maskKey = None
     
     def setRect(self):
         self.rect = self.surface.get_rect()
         self.rect.x = self.attribute['x']
         self.rect.y = self.attribute['y']
+        self.previousPosition = self.rect.topleft # Where the last tick left the rect, for interpolateRect
     
     def image(self):
         # See if I can delete these methods
@@ -311,278 +1162,2905 @@ class Actor(pygame.sprite.Sprite):
         return self.rect
     
     def reset(self):
-        print('Reset')
-        self.attribute['x'] = 0
-        self.attribute['y'] = 0
-        self.attribute['z'] = 0
-        self.attribute['engineSpeed'] = 0
+        log.info('actor', 'Reset')
+        self.wake()
+        state = self.attribute
+        state.x = 0
+        state.y = 0
+        state.z = 0
+        state.engineSpeed = 0
     
     def fire(self):
-        momentum = [self.attribute['xs'], self.attribute['ys'], self.attribute['zs'], 0] # xs, ys, zs, rs
-        coord = [self.attribute['x'], self.attribute['y'], self.attribute['z'], self.attribute['r']]
+        state = self.attribute
+        momentum = [state.xs, state.ys, state.zs, 0] # xs, ys, zs, rs
         
         for attachment in self.attachmentList:
             if attachment.getAttachmentAttribute()['name'] == 'gun':
-                attachment.fire(coord, momentum)
+                attachment.fire(momentum)
+    
+    def updateWeapons(self):
+        for attachment in self.attachmentList:
+            if attachment.burstLeft:
+                attachment.updateWeapon()
+    
+    def resetWeapons(self):
+        # Cancels bursts and cooldowns, so a pooled Actor comes back ready to fire
+        for attachment in self.attachmentList:
+            if attachment.burstLeft:
+                self.game.firingCount -= 1
+            
+            attachment.readyTick = 0
+            attachment.burstLeft = 0
+            attachment.nextShotTick = 0
+        
+        self.firing = 0
     
     def thrust(self, dir, coef=None):
         # dir: 1 - forwards, -1 - backwards
+        state = self.attribute
+        self.wake()
+        
         if coef == None:
-            coef = self.attribute['thrustSpeed']
+            coef = self.template.thrustSpeed
             
-        radR = math.radians(self.attribute['r'])
+        radR = math.radians(state.r)
         
         # * -1 because (0, 0) is top-left and we have to flip the coordinates
-        x = coef * dir * math.sin(radR) * -1
-        y = coef * dir * math.cos(radR) * -1
+        x = coef * dir * math.sin(radR) * -1 * self.game.stepScale
+        y = coef * dir * math.cos(radR) * -1 * self.game.stepScale
         
-        self.attribute['xs'] += x
-        self.attribute['ys'] += y
+        state.xs += x
+        state.ys += y
     
     def runEngine(self):
         # Adds thrust on update()
-        self.thrust(1, self.attribute['engineSpeed'])
+        self.thrust(1, self.attribute.engineSpeed)
         
     def modifyEngineSpeed(self, dir, accelChange=None):
+        state = self.attribute
+        template = self.template
+        self.wake()
+        
         if dir == 1:
-            accelChange = self.attribute['engineAccel']
+            accelChange = template.engineAccel
         elif dir == -1:
-            accelChange = self.attribute['engineDeaccel']
-    
-        if self.attribute['engineSpeed'] + accelChange > self.attribute['engineMaxAccel']:
-            self.attribute['engineSpeed'] = self.attribute['engineMaxAccel']
-        elif self.attribute['engineSpeed'] + accelChange < self.attribute['engineMinAccel']:
-            self.attribute['engineSpeed'] = self.attribute['engineMinAccel']
+            accelChange = template.engineDeaccel
+        
+        accelChange *= self.game.stepScale # Per reference tick it's held for
+        
+        if state.engineSpeed + accelChange > template.engineMaxAccel:
+            state.engineSpeed = template.engineMaxAccel
+        elif state.engineSpeed + accelChange < template.engineMinAccel:
+            state.engineSpeed = template.engineMinAccel
         else:
-            self.attribute['engineSpeed'] += accelChange
+            state.engineSpeed += accelChange
     
     def move(self, coord):
         # Modify Speed & Acceleration
-        if coord[0] > 0 and self.attribute['xs'] <= self.attribute['xsMax']:
-            self.attribute['xs'] = self.attribute['xs'] + self.attribute['xa']
-        elif  coord[0] < 0 and self.attribute['xs'] >= self.attribute['xsMin']:
-            self.attribute['xs'] -= self.attribute['xa']
-        
-        if coord[1] > 0 and self.attribute['ys'] <= self.attribute['ysMax']:
-            self.attribute['ys'] += self.attribute['ya']
-        elif coord[1] < 0 and self.attribute['ys'] >= self.attribute['ysMin']:
-            self.attribute['ys'] -= self.attribute['ya']
-        
-        if coord[2] > 0 and self.attribute['zs'] <= self.attribute['zsMax']:
-            self.attribute['zs'] += self.attribute['za']
-        elif coord[2] < 0 and self.attribute['zs'] >= self.attribute['zsMin']:
-            self.attribute['zs'] -= self.attribute['za']
-        
-        if coord[3] > 0 and self.attribute['rs'] <= self.attribute['rsMax']:
-            self.attribute['rs'] += self.attribute['ra']
-        elif coord[3] < 0 and self.attribute['rs'] >= self.attribute['rsMin']:
-            self.attribute['rs'] -= self.attribute['ra']
+        state = self.attribute
+        template = self.template
+        scale = self.game.stepScale
+        self.wake()
+        
+        if coord[0] > 0 and state.xs <= template.xsMax:
+            state.xs = state.xs + template.xa * scale
+        elif  coord[0] < 0 and state.xs >= template.xsMin:
+            state.xs -= template.xa * scale
+        
+        if coord[1] > 0 and state.ys <= template.ysMax:
+            state.ys += template.ya * scale
+        elif coord[1] < 0 and state.ys >= template.ysMin:
+            state.ys -= template.ya * scale
+        
+        if coord[2] > 0 and state.zs <= template.zsMax:
+            state.zs += template.za * scale
+        elif coord[2] < 0 and state.zs >= template.zsMin:
+            state.zs -= template.za * scale
+        
+        if coord[3] > 0 and state.rs <= template.rsMax:
+            state.rs += template.ra * scale
+        elif coord[3] < 0 and state.rs >= template.rsMin:
+            state.rs -= template.ra * scale
     
     def updateX(self, xCoord):    
+        state = self.attribute
+        template = self.template
+        
         # Speed
-        if self.attribute['xs'] > self.attribute['xsMax']:
-            self.attribute['xs'] = self.attribute['xsMax']
-        elif self.attribute['xs'] < self.attribute['xsMin']:
-            self.attribute['xs'] = self.attribute['xsMin']
+        if state.xs > template.xsMax:
+            state.xs = template.xsMax
+        elif state.xs < template.xsMin:
+            state.xs = template.xsMin
         
-        newx = self.attribute['x'] + xCoord + self.attribute['xs']
+        newx = state.x + xCoord + state.xs * self.game.stepScale
         
         # Boundary, x relative to screen edge
-        if newx > self.attribute['xMax'] + game.screenWidth:
-            #newx = self.attribute['xMax'] # Uncomment to make it wrap
-            newx = self.attribute['xMax'] + game.screenWidth
-        elif newx < self.attribute['xMin']:
-            newx = self.attribute['xMin']
+        if newx > template.xMax + self.game.screenWidth:
+            #newx = template.xMax # Uncomment to make it wrap
+            newx = template.xMax + self.game.screenWidth
+        elif newx < template.xMin:
+            newx = template.xMin
         
-        self.attribute['x'] = newx
+        state.x = newx
     
     def updateY(self, yCoord):
+        state = self.attribute
+        template = self.template
+        
         # Speed
-        if self.attribute['ys'] > self.attribute['ysMax']:
-            self.attribute['ys'] = self.attribute['ysMax']
-        elif self.attribute['ys'] < self.attribute['ysMin']:
-            self.attribute['ys'] = self.attribute['ysMin']
+        if state.ys > template.ysMax:
+            state.ys = template.ysMax
+        elif state.ys < template.ysMin:
+            state.ys = template.ysMin
         
-        newy = self.attribute['y'] + yCoord + self.attribute['ys']
+        newy = state.y + yCoord + state.ys * self.game.stepScale
         
         # Boundary, y relative to screen edge
-        if newy > self.attribute['yMax'] + game.screenHeight:
-            #newy = self.attribute['yMax'] # Uncomment to wrap
-            newy = self.attribute['yMax'] + game.screenHeight
-        elif newy < self.attribute['yMin']:
-            newy = self.attribute['yMin']
+        if newy > template.yMax + self.game.screenHeight:
+            #newy = template.yMax # Uncomment to wrap
+            newy = template.yMax + self.game.screenHeight
+        elif newy < template.yMin:
+            newy = template.yMin
         
-        self.attribute['y'] = newy
+        state.y = newy
     
     def updateScale(self):
+        state = self.attribute
+        template = self.template
+        
         # Scaling
-        if self.attribute['s'] <= self.attribute['sMax'] and self.attribute['s'] >= self.attribute['sMin']:
-            newScale = self.attribute['s'] + self.attribute['zs'] / 100 # To make it into a decimal representation of scaling
+        if state.s <= template.sMax and state.s >= template.sMin:
+            newScale = state.s + state.zs / 100 * self.game.stepScale # To make it into a decimal representation of scaling
             
-            if newScale > self.attribute['sMax']:
-                newScale = self.attribute['sMax']
-            elif newScale < self.attribute['sMin']:
-                newScale = self.attribute['sMin']
+            if newScale > template.sMax:
+                newScale = template.sMax
+            elif newScale < template.sMin:
+                newScale = template.sMin
             
-            self.attribute['s'] = newScale
+            state.s = newScale
         # TODO: Add speed changes for scaling, or change camera height to simulate parallax scrolling
     
     def updateRotation(self, rot):
+        state = self.attribute
+        template = self.template
+        
         # Rotation
-        if self.attribute['r'] <= self.attribute['rMax'] and self.attribute['r'] >= self.attribute['rMin']:
-            if self.attribute['rs'] > self.attribute['rsMax']:
-                self.attribute['rs'] = self.attribute['rsMax']
-            elif self.attribute['rs'] < self.attribute['rsMin']:
-                self.attribute['rs'] = self.attribute['rsMin']
+        if state.r <= template.rMax and state.r >= template.rMin:
+            if state.rs > template.rsMax:
+                state.rs = template.rsMax
+            elif state.rs < template.rsMin:
+                state.rs = template.rsMin
             
-            newRot = self.attribute['r'] + rot + self.attribute['rs']
+            newRot = state.r + rot + state.rs * self.game.stepScale
             
-            if newRot > self.attribute['rMax']:
-                newRot = self.attribute['rMax']
-            elif newRot < self.attribute['rMin']:
-                newRot = self.attribute['rMin']
+            if newRot > template.rMax:
+                newRot = template.rMax
+            elif newRot < template.rMin:
+                newRot = template.rMin
             
             # For unlimited rotation
-            if newRot == self.attribute['rMax'] or newRot == self.attribute['rMin']:
+            if newRot == template.rMax or newRot == template.rMin:
                 newRot = 0
             
-            self.attribute['r'] = newRot
+            state.r = newRot
     
     def updateFriction(self):
-        if self.attribute['xs'] > 0:
-            newxs = self.attribute['xs'] - self.attribute['xFricCoef']
+        state = self.attribute
+        template = self.template
+        scale = self.game.stepScale
+        
+        if state.xs > 0:
+            newxs = state.xs - template.xFricCoef * scale
             # Makes sure it doesn't glitch at low speeds
             if newxs < 0: newxs = 0
-        elif self.attribute['xs'] < 0:
-            newxs = self.attribute['xs'] + self.attribute['xFricCoef']
+        elif state.xs < 0:
+            newxs = state.xs + template.xFricCoef * scale
             if newxs > 0: newxs = 0
         else:
             newxs = 0
-        self.attribute['xs'] = newxs
+        state.xs = newxs
         
-        if self.attribute['ys'] > 0:
-            newys = self.attribute['ys'] - self.attribute['yFricCoef']
+        if state.ys > 0:
+            newys = state.ys - template.yFricCoef * scale
             if newys < 0: newys = 0
-        elif self.attribute['ys'] < 0:
-            newys = self.attribute['ys'] + self.attribute['yFricCoef']
+        elif state.ys < 0:
+            newys = state.ys + template.yFricCoef * scale
             if newys > 0: newys = 0
         else:
             newys = 0
-        self.attribute['ys'] = newys
+        state.ys = newys
         
-        if self.attribute['zs'] > 0:
-            newzs = self.attribute['zs'] - self.attribute['zFricCoef']
+        if state.zs > 0:
+            newzs = state.zs - template.zFricCoef * scale
             if newzs < 0: newzs = 0
-        elif self.attribute['zs'] < 0:
-            newzs = self.attribute['zs'] + self.attribute['zFricCoef']
+        elif state.zs < 0:
+            newzs = state.zs + template.zFricCoef * scale
             if newzs > 0: newzs = 0
         else:
             newzs = 0
-        self.attribute['zs'] = newzs
+        state.zs = newzs
         
-        if self.attribute['rs'] > 0:
-            newrs = self.attribute['rs'] - self.attribute['rFricCoef']
+        if state.rs > 0:
+            newrs = state.rs - template.rFricCoef * scale
             if newrs < 0: newrs = 0
-        elif self.attribute['rs'] < 0:
-            newrs = self.attribute['rs'] + self.attribute['rFricCoef']
+        elif state.rs < 0:
+            newrs = state.rs + template.rFricCoef * scale
             if newrs > 0: newrs = 0
         else:
             newrs = 0
-        self.attribute['rs'] = newrs
+        state.rs = newrs
     
     def updateRect(self):
-        self.rect.x = self.attribute['x']
-        self.rect.y = self.attribute['y']
-    
-    def updateAttachments(self):
-        for attachment in self.attachmentList:
-            attachment.update()
+        self.rect.x = self.attribute.x
+        self.rect.y = self.attribute.y
     
-    def drawAttachments(self):
-        self.attachmentGroup.clear(self.surface, self.image)
+    def interpolateRect(self, alpha, rect=None):
+        # Moves the rect alpha of the way from where the previous tick left it, drawOutput puts it back after
+        # rect: A copy of the rect to move instead, for FrameBuffer
+        if rect is None:
+            rect = self.rect
         
-        # Only update changed areas for speed
-        dirty = self.attachmentGroup.draw(self.surface)
-        pygame.display.update(dirty)
+        previousX, previousY = self.previousPosition
+        rect.x = round(previousX + (rect.x - previousX) * alpha)
+        rect.y = round(previousY + (rect.y - previousY) * alpha)
     
     def removeAttachments(self):
         for attachment in self.attachmentList:
             attachment.remove(self.attachmentGroup)
     
     def checkDestroyConditions(self):
-        # Maximum/minimum distance off screen
-        if self.attribute['x'] > (game.screenWidth + self.attribute['xDestroyMax']) or self.attribute['x'] < self.attribute['xDestroyMin']:
+        state = self.attribute
+        template = self.template
+        
+        # Maximum/minimum distance off screen, one destruct however many are broken
+        if state.x > (self.game.screenWidth + template.xDestroyMax) or state.x < template.xDestroyMin:
+            self.destruct()
+        elif state.y > (self.game.screenHeight + template.yDestroyMax) or state.y < template.yDestroyMin:
+            self.destruct()
+        elif state.z > template.zDestroyMax or state.z < template.zDestroyMin:
+            self.destruct()
+        elif state.hp <= 0:
+            # play explode sprite
             self.destruct()
+        elif self.expires:
+            # Lives exactly ttl ticks, like it would in ProjectileBuffer.step
+            state.ttl -= 1
+            
+            if state.ttl < 0:
+                self.destruct()
+    
+    def takeDamage(self, damage):
+        if self.template.damagable == True:
+            self.wake()
+            self.attribute.hp -= damage
+            log.debug('combat', 'takeDamage: {} taking {} damage, hp: {}', self.template.name, damage, self.attribute.hp)
+            return True
+        else:
+            return False
+    
+    def destruct(self):
+        # Queued, Game.compactActors removes it at the end of the tick
+        if not self.destroyed and self.actorIndex is not None:
+            self.destroyed = True
+            self.game.destroyedActors.append(self)
+        
+    def detectCollisions(self):
+        # The pairs themselves are found by game.collisions, once per tick for every Actor
+        if self.attribute.primerTicks > 0:
+            self.attribute.primerTicks -= 1
+    
+    def canCollide(self):
+        # Primed Actors that collide with some layer, ie. bullets
+        return self.attribute.primerTicks <= 0 and bool(self.template.collidesWith)
+    
+    def hit(self, target):
+        """ Returns the damage target takes, CollisionSystem.resolve applies it with everything else it takes this tick
+        """
+        if target.template.damagable == True:
+            self.wake()
+            self.attribute.hp -= 1 # In effect, hp is the number of hits a bullet can do
+            return self.template.damage
+        return 0
+    
+    def update(self):
+        self.updateState()
+        
+        if not self.destroyed:
+            self.updatePhysics()
+            self.updateOutput()
+    
+    def updateState(self):
+        self.detectCollisions()
+        self.checkDestroyConditions()
+    
+    def updatePhysics(self):
+        # Scalar path, PhysicsWorld.step does the same for every Actor at once
+        self.updateFriction()
+        self.runEngine()
+        self.updateX(0)
+        self.updateY(0)
+        self.updateScale()
+        self.updateRotation(0)
+    
+    def wake(self):
+        # Input, collisions and damage all wake a sleeping Actor
+        if self.awakeIndex is None and self.actorIndex is not None:
+            self.game.wakeActor(self)
+    
+    def checkSleep(self):
+        """ Sleeps the Actor once it's been at rest for sleepTicks in a row
+        At rest nothing in updateState or updatePhysics changes it, so skipping them is free
+        """
+        state = self.attribute
+        
+        if (state.xs == 0 and state.ys == 0 and state.zs == 0 and state.rs == 0 and state.engineSpeed == 0
+                and state.primerTicks <= 0 and not self.firing and not self.expires):
+            self.restTicks += 1
+            
+            if self.restTicks == self.sleepTicks:
+                self.game.restingActors.append(self)
+        else:
+            self.restTicks = 0
+    
+    def updateOutput(self):
+        self.previousPosition = self.rect.topleft
+        self.updateRect()
+        self.visible = self.rect.colliderect(self.game.screenRect)
+        
+        if self.visible:
+            # Off-screen Actors skip the transform and attachment work, it's redone when they come back
+            if self.attribute.z != self.depthZ:
+                self.game.depths.move(self)
+            
+            if self.compositeDirty:
+                self.updateComposite()
+            
+            self.updateImage()
+        
+        self.checkSleep()
+    
+    def updateStateProfiled(self, profiler):
+        self.detectCollisions()
+        profiler.mark('Actor.detectCollisions')
+        self.checkDestroyConditions()
+        profiler.mark('Actor.checkDestroyConditions')
+    
+    def updateOutputProfiled(self, profiler):
+        self.previousPosition = self.rect.topleft
+        self.updateRect()
+        self.visible = self.rect.colliderect(self.game.screenRect)
+        
+        if self.visible:
+            if self.attribute.z != self.depthZ:
+                self.game.depths.move(self)
+            
+            if self.compositeDirty:
+                self.updateComposite()
+                profiler.mark('Actor.updateComposite')
+            
+            self.updateImage()
+            profiler.mark('Actor.updateImage')
+        
+        self.checkSleep()
+    
+    def updateImage(self):
+        r = self.attribute.r
+        s = self.attribute.s
+        
+        if self.attachmentList:
+            # Attachments are drawn onto this Actor's own baseImage, so it can't share cached images by imageId,
+            # but it's still only rotozoomed, and its mask rebuilt, when it turns into another bucket
+            key = self.game.transforms.key(None, r, s)
+            
+            if self.transformKey != key:
+                self.transformKey = key
+                self.image = self.game.transforms.transform(key, self.baseImage)
+                
+                if self.game.collisions.masks is not None:
+                    self.game.collisions.masks.build(self) # Here, so the collision loop only reads it
+        else:
+            key = self.game.transforms.key(self.template.imageId, r, s)
+            
+            if self.transformKey != key:
+                self.transformKey = key
+                self.image = self.game.transforms.get(key, self.baseImage)
+                
+                if self.game.collisions.masks is not None:
+                    self.game.collisions.masks.get(self) # Built here with the image, not in the collision loop
+        
+        
+
+class KeyState:
+    """ Stands in for pygame.key.get_pressed() when input doesn't come from the keyboard
+    """
+    def __init__(self, pressed=()):
+        self.pressed = frozenset(pressed)
+    
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+
+class InputLog:
+    """ Per-tick input, recorded from Game.tick and replayed as Game.run's or Game.main's inputSource
+    Each tick is a bitmap of the keys handleInput polls, and the events it acts on are kept
+    sparsely as (tick, code), so a session costs a few bytes a tick
+    """
+    magic = b'OQIR'
+    version = 1
+    header = struct.Struct('=4sHqIH') # magic, version, seed, ticks, scenario name length
+    keys = (K_w, K_s, K_LSHIFT, K_LCTRL, K_d, K_a, K_r, K_f, K_e, K_q, K_SPACE, K_c) # Every key Game.handleInput polls
+    eventKeys = (K_RETURN, K_ESCAPE, K_F3, K_F4, K_BACKSPACE) # KEYDOWNs it acts on
+    fireCode = len(eventKeys)
+    quitCode = len(eventKeys) + 1
+    
+    def __init__(self, seed=0, scenario='default'):
+        self.seed = seed # The Game's, a replay needs the same seed and scenario to match
+        self.scenario = scenario
+        self.bitmaps = array('H')
+        self.eventTicks = array('I')
+        self.eventCodes = array('B')
+        self.cursor = 0 # Next tick to replay
+    
+    def __len__(self):
+        return len(self.bitmaps)
+    
+    def record(self, events, keys):
+        tick = len(self.bitmaps)
+        bitmap = 0
+        
+        for bit, key in enumerate(self.keys):
+            if keys[key]:
+                bitmap |= 1 << bit
+        
+        self.bitmaps.append(bitmap)
+        
+        for event in events:
+            if event.type == MOUSEBUTTONDOWN:
+                code = self.fireCode
+            elif event.type == QUIT:
+                code = self.quitCode
+            elif event.type == KEYDOWN and event.key in self.eventKeys:
+                code = self.eventKeys.index(event.key)
+            else:
+                continue
+            
+            self.eventTicks.append(tick)
+            self.eventCodes.append(code)
+    
+    def getInput(self, tickCount):
+        """ The next tick's (events, keys), replayed in order whatever tickCount is, since a rewind
+        moves tickCount back. Once the log runs out it returns None, so main() stops without ticking again
+        """
+        tick = self.cursor
+        
+        if tick >= len(self.bitmaps):
+            return None
+        
+        self.cursor += 1
+        
+        bitmap = self.bitmaps[tick]
+        keys = KeyState(key for bit, key in enumerate(self.keys) if bitmap & (1 << bit))
+        events = []
+        index = bisect.bisect_left(self.eventTicks, tick)
+        
+        while index < len(self.eventTicks) and self.eventTicks[index] == tick:
+            code = self.eventCodes[index]
+            
+            if code == self.fireCode:
+                events.append(pygame.event.Event(MOUSEBUTTONDOWN, button=1, pos=(0, 0)))
+            elif code == self.quitCode:
+                events.append(pygame.event.Event(QUIT))
+            else:
+                events.append(pygame.event.Event(KEYDOWN, key=self.eventKeys[code], mod=0, unicode=''))
+            
+            index += 1
+        
+        return events, keys
+    
+    def save(self, path):
+        scenario = self.scenario.encode('utf-8')
+        
+        with open(path, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.version, self.seed, len(self.bitmaps), len(scenario)))
+            f.write(scenario)
+            f.write(self.bitmaps.tobytes())
+            f.write(struct.pack('=I', len(self.eventTicks)))
+            f.write(self.eventTicks.tobytes())
+            f.write(self.eventCodes.tobytes())
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        
+        magic, version, seed, ticks, scenarioLength = cls.header.unpack_from(data, 0)
+        
+        if magic != cls.magic or version != cls.version:
+            raise ValueError('{} is not a version {} input log'.format(path, cls.version))
+        
+        offset = cls.header.size
+        inputLog = cls(seed, data[offset:offset + scenarioLength].decode('utf-8'))
+        offset += scenarioLength
+        inputLog.bitmaps.frombytes(data[offset:offset + ticks * inputLog.bitmaps.itemsize])
+        offset += ticks * inputLog.bitmaps.itemsize
+        eventCount, = struct.unpack_from('=I', data, offset)
+        offset += 4
+        inputLog.eventTicks.frombytes(data[offset:offset + eventCount * inputLog.eventTicks.itemsize])
+        offset += eventCount * inputLog.eventTicks.itemsize
+        inputLog.eventCodes.frombytes(data[offset:offset + eventCount])
+        return inputLog
+
+
+
+class EventLog:
+    """ Leveled, per-category log that keeps print() and string formatting out of the game loop
+    Records below their level are dropped before anything is formatted. The rest go into a ring
+    buffer that a background thread formats and writes out, to the console and optionally a file
+    """
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    levelNames = {10: 'DEBUG', 20: 'INFO', 30: 'WARNING', 40: 'ERROR'}
+    
+    def __init__(self, level=INFO, bufferLength=65536, flushInterval=0.25):
+        """
+        bufferLength: Records held before the oldest unflushed ones are dropped
+        flushInterval: Seconds between background flushes
+        """
+        self.level = level
+        self.categoryLevels = {} # category: level, overrides self.level
+        self.consoleLevel = level # None to keep the console quiet
+        self.buffer = deque(maxlen=bufferLength)
+        self.flushInterval = flushInterval
+        self.file = None
+        self.jsonLines = False
+        self.writeLock = threading.Lock()
+        self.wakeUp = threading.Event()
+        self.thread = None
+    
+    def configure(self, level=None, consoleLevel=False, path=None, jsonLines=False, categoryLevels=None):
+        """
+        level, consoleLevel: Level names or numbers, consoleLevel None silences the console
+        path: File to also write records to, as text or with jsonLines as one JSON object per line
+        categoryLevels: {category: level} for turning single categories up or down
+        """
+        if level is not None:
+            self.level = self.getLevel(level)
+            self.consoleLevel = self.level
+        
+        if consoleLevel is not False:
+            self.consoleLevel = None if consoleLevel is None else self.getLevel(consoleLevel)
+        
+        if categoryLevels:
+            for category, categoryLevel in categoryLevels.items():
+                self.categoryLevels[category] = self.getLevel(categoryLevel)
+        
+        if path is not None:
+            self.flush()
+            
+            if self.file is not None:
+                self.file.close()
+            
+            self.file = open(path, 'a')
+            self.jsonLines = jsonLines
+    
+    def getLevel(self, level):
+        if isinstance(level, str):
+            return getattr(self, level.upper())
+        return level
+    
+    def write(self, level, category, message, args):
+        # Only the arguments are stored, they're formatted on the flush thread
+        if level < self.categoryLevels.get(category, self.level):
+            return
+        
+        self.buffer.append((time.time(), level, category, message, args))
+        
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='EventLog', daemon=True)
+            self.thread.start()
+    
+    def debug(self, category, message, *args):
+        self.write(10, category, message, args)
+    
+    def info(self, category, message, *args):
+        self.write(20, category, message, args)
+    
+    def warning(self, category, message, *args):
+        self.write(30, category, message, args)
+    
+    def error(self, category, message, *args):
+        self.write(40, category, message, args)
+    
+    def run(self):
+        while True:
+            self.wakeUp.wait(self.flushInterval)
+            self.wakeUp.clear()
+            self.flush()
+    
+    def flush(self):
+        """ Formats and writes out everything in the buffer, called by the flush thread and at exit
+        """
+        with self.writeLock:
+            while self.buffer:
+                try:
+                    recordTime, level, category, message, args = self.buffer.popleft()
+                except IndexError:
+                    break
+                
+                try:
+                    text = message.format(*args) if args else message
+                except BaseException as e:
+                    text = '{} (formatting error: {})'.format(message, e)
+                
+                if self.consoleLevel is not None and level >= self.consoleLevel:
+                    print(text)
+                
+                if self.file is not None:
+                    if self.jsonLines:
+                        line = json.dumps({'time': recordTime, 'level': self.levelNames[level], 'category': category, 'message': text})
+                    else:
+                        line = '{:.3f} {} {}: {}'.format(recordTime, self.levelNames[level], category, text)
+                    self.file.write(line + '\n')
+            
+            if self.file is not None:
+                self.file.flush()
+    
+    def close(self):
+        self.flush()
+        
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+log = EventLog()
+atexit.register(log.close)
+
+
+
+class AssetManager:
+    """ Loads and converts each image once, then hands out the same surface to every Actor using it
+    """
+    fonts = {} # size: Font, shared by every Game since fonts never change
+    
+    def __init__(self, imagePath=os.path.join(rootPath, 'i', 'Actors'), cache=None):
+        """
+        cache: An opened AssetCache to take images' pixels from instead of decoding their files
+        """
+        self.imagePath = imagePath
+        self.cache = cache
+        self.images = {} # imageId: converted surface
+        self.preloaded = {} # imageId: surface loaded by the preload thread, converted on first use
+        self.preloadLock = threading.Lock()
+        self.preloadThread = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0 # Disk reads, should stop growing once every type has spawned
+    
+    def getImageFile(self, imageId):
+        return '{}/{}.png'.format(self.imagePath, imageId)
+    
+    def loadImage(self, imageId):
+        if self.cache is not None:
+            image = self.cache.getImage(imageId)
+            
+            if image is not None:
+                return image
+        
+        image = pygame.image.load(self.getImageFile(imageId))
+        self.loads += 1
+        return image
+    
+    @classmethod
+    def getFont(cls, size):
+        """ The default font at size, initialising the font module on first use. None without font support
+        """
+        font = cls.fonts.get(size)
+        
+        if font is None:
+            if not pygame.font:
+                return None
+            
+            if not pygame.font.get_init():
+                pygame.font.init()
+            
+            font = cls.fonts[size] = pygame.font.Font(None, size)
+        
+        return font
+    
+    def getImage(self, imageId):
+        image = self.images.get(imageId)
+        
+        if image is not None:
+            self.hits += 1
+            return image
+        
+        self.misses += 1
+        
+        with self.preloadLock:
+            image = self.preloaded.pop(imageId, None)
+        
+        if image is None:
+            image = self.loadImage(imageId)
+        
+        # Converting needs the display, so it is always done here rather than on the preload thread
+        image = image.convert_alpha()
+        self.images[imageId] = image
+        return image
+    
+    def preload(self, imageIds):
+        for imageId in imageIds:
+            if imageId not in self.images:
+                self.getImage(imageId)
+    
+    def preloadAsync(self, imageIds):
+        """ Reads images from disk on a worker thread so the game loop only has to convert them
+        """
+        def worker():
+            for imageId in imageIds:
+                try:
+                    image = self.loadImage(imageId)
+                except BaseException as e:
+                    log.error('assets', 'AssetManager: preloadAsync: Error loading image {}: {}', imageId, e)
+                    continue
+                
+                with self.preloadLock:
+                    self.preloaded[imageId] = image
+        
+        self.preloadThread = threading.Thread(target=worker, name='AssetPreload', daemon=True)
+        self.preloadThread.start()
+
+
+
+class AssetCache:
+    """ objects.json and every image's pixels in one binary file, built on the first launch and memory-mapped
+    on the next ones, so startup skips parsing and validating the JSON and decoding the PNGs
+    It records the mtime and size of every file it was built from, and is rebuilt as soon as one differs
+    """
+    header = struct.Struct('=4sHHIII') # Magic, version, marshal version, sources, attributes and index lengths
+    magic = b'OQAC'
+    version = 1
+    
+    def __init__(self, path, objectsPath, imagePath=os.path.join(rootPath, 'i', 'Actors')):
+        """
+        path: The cache file, its directory is created when it's first built
+        objectsPath: The objects.json it caches
+        imagePath: Where the images objects.json refers to are
+        """
+        self.path = path
+        self.objectsPath = objectsPath
+        self.imagePath = imagePath
+        self.map = None
+        self.attributes = None # (offset, length) of the marshalled attributes in the map
+        self.images = {} # imageId: (offset, width, height) of its RGBA pixels in the map
+        self.builds = 0
+    
+    @staticmethod
+    def getModified(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def open(self):
+        """ Maps the cache, building it first if it's missing or stale
+        Returns False if that failed too, so the sources have to be read instead
+        """
+        if self.map is not None:
+            return True
+        
+        try:
+            if self.load():
+                return True
+        except (OSError, ValueError, EOFError, TypeError, struct.error) as e:
+            log.warning('assets', 'AssetCache: Rebuilding unreadable {}: {}', self.path, e)
+            self.close()
+        
+        try:
+            self.build()
+            return self.load()
+        except BaseException as e:
+            log.error('assets', 'AssetCache: open: Error building {}: {}', self.path, e)
+            self.close()
+            return False
+    
+    def load(self):
+        """ Maps the cache file, returns False if it's missing or any source changed since it was built
+        """
+        if not os.path.isfile(self.path):
+            return False
+        
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, version, marshalVersion, sourcesLength, attributesLength, indexLength = self.header.unpack_from(mapped, 0)
+        
+        if magic != self.magic or version != self.version or marshalVersion != marshal.version:
+            mapped.close()
+            return False
+        
+        offset = self.header.size
+        sources = marshal.loads(mapped[offset:offset + sourcesLength])
+        
+        for path, modified in sources.items():
+            if self.getModified(path) != modified:
+                log.info('assets', 'AssetCache: {} changed, rebuilding {}', path, self.path)
+                mapped.close()
+                return False
+        
+        offset += sourcesLength
+        self.attributes = (offset, attributesLength)
+        offset += attributesLength
+        index = marshal.loads(mapped[offset:offset + indexLength])
+        pixelsOffset = offset + indexLength
+        self.images = dict((imageId, (pixelsOffset + start, width, height)) for imageId, (start, width, height) in index.items())
+        self.map = mapped
+        return True
+    
+    def build(self):
+        """ Parses and validates objects.json, decodes every image it refers to, and writes them all out
+        """
+        sources = {self.objectsPath: self.getModified(self.objectsPath)} # Before reading, so a save mid-build is seen next time
+        
+        with open(self.objectsPath, 'r') as f:
+            attributesList = json.loads(f.read())
+        
+        errors = AttributeWatcher.validate(attributesList, {})
+        if errors:
+            raise ValueError('; '.join(errors))
+        
+        index = {}
+        pixels = []
+        offset = 0
+        
+        for imageId in sorted(set(attribute['imageId'] for attribute in attributesList['objects'].values())):
+            path = '{}/{}.png'.format(self.imagePath, imageId)
+            modified = self.getModified(path)
+            
+            try:
+                image = pygame.image.load(path)
+            except BaseException as e:
+                log.warning('assets', 'AssetCache: Not caching image {}: {}', imageId, e)
+                continue
+            
+            data = pygame.image.tostring(image, 'RGBA')
+            sources[path] = modified
+            index[imageId] = (offset, image.get_width(), image.get_height())
+            pixels.append(data)
+            offset += len(data)
+        
+        sourcesData = marshal.dumps(sources)
+        attributesData = marshal.dumps(attributesList)
+        indexData = marshal.dumps(index)
+        
+        # Written aside then renamed over, so another process never maps half a cache
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporaryPath = '{}.{}.tmp'.format(self.path, os.getpid())
+        
+        with open(temporaryPath, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.version, marshal.version, len(sourcesData), len(attributesData),
+                len(indexData)))
+            f.write(sourcesData)
+            f.write(attributesData)
+            f.write(indexData)
+            
+            for data in pixels:
+                f.write(data)
+        
+        os.replace(temporaryPath, self.path)
+        self.builds += 1
+        log.info('assets', 'AssetCache: Built {} with {} images', self.path, len(index))
+    
+    def getAttributes(self):
+        """ A fresh copy of the cached objects.json, the Game applies its overrides to it
+        """
+        offset, length = self.attributes
+        return marshal.loads(self.map[offset:offset + length])
+    
+    def getImage(self, imageId):
+        """ The image's cached pixels as an unconverted surface, or None if it isn't cached
+        """
+        entry = self.images.get(imageId)
+        
+        if entry is None or self.map is None:
+            return None
+        
+        offset, width, height = entry
+        pixels = self.map[offset:offset + width * height * 4]
+        return pygame.image.frombuffer(pixels, (width, height), 'RGBA')
+    
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        
+        self.images = {}
+
+
+
+class AttributeWatcher:
+    """ Watches objects.json from a worker thread for hot-reloading
+    When the file's mtime changes it's parsed, validated, diffed against what the Game has and
+    the changed types' templates compiled, all off the main thread, so Game.reloadAttributes
+    only has to swap them in at the next tick boundary
+    """
+    def __init__(self, path, attributesList, overrides=None, interval=0.5):
+        """
+        path: The objects.json to poll
+        attributesList: The Game's loaded attributes, the first change is diffed against them
+        overrides: The Game's overrides, applied over every reload too
+        interval: Seconds between polls
+        """
+        self.path = path
+        self.overrides = overrides
+        self.interval = interval
+        self.loaded = attributesList['objects']
+        self.modified = self.getModified()
+        self.pending = None # (attributesList, {id: ActorTemplate}) waiting for the next tick
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.reloads = 0
+        self.thread = threading.Thread(target=self.run, name='AttributeWatcher', daemon=True)
+        self.thread.start()
+    
+    def getModified(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            modified = self.getModified()
+            
+            if modified is None or modified == self.modified:
+                continue
+            
+            self.modified = modified
+            
+            try:
+                self.check()
+            except BaseException as e:
+                log.error('game', 'AttributeWatcher: Error reloading {}: {}', self.path, e)
+    
+    def check(self):
+        with open(self.path, 'r') as f:
+            attributesList = json.loads(f.read())
+        
+        errors = self.validate(attributesList, self.loaded)
+        
+        if errors:
+            log.warning('game', 'AttributeWatcher: Not reloading {}: {}', self.path, '; '.join(errors))
+            return
+        
+        objects = attributesList['objects']
+        
+        for id, attributes in (self.overrides or {}).items():
+            if str(id) in objects:
+                objects[str(id)].update(attributes)
+        
+        removed = set(self.loaded) - set(objects)
+        if removed:
+            log.warning('game', 'AttributeWatcher: Types {} were removed, they keep their old attributes', sorted(removed))
+            
+            for id in removed:
+                objects[id] = self.loaded[id]
+        
+        changed = {}
+        for id, attributes in objects.items():
+            if self.loaded.get(id) != attributes:
+                changed[int(id)] = ActorTemplate(attributes)
+        
+        if not changed:
+            return
+        
+        self.loaded = objects
+        
+        with self.lock:
+            if self.pending is not None:
+                # Not swapped in yet, so its changes still have to be
+                changed = dict(self.pending[1], **changed)
+            self.pending = (attributesList, changed)
+        
+        log.info('game', 'AttributeWatcher: Types {} changed', sorted(changed))
+    
+    @staticmethod
+    def validate(attributesList, loaded):
+        """ Reasons the new attributes can't be swapped in, an empty list if they can
+        A type has to keep every attribute it had, and numbers have to stay numbers
+        """
+        if not isinstance(attributesList, dict) or not isinstance(attributesList.get('objects'), dict):
+            return ['no objects']
+        
+        errors = []
+        
+        for id, attributes in attributesList['objects'].items():
+            if not isinstance(attributes, dict):
+                errors.append('{} is not an object'.format(id))
+                continue
+            
+            if not id.isdigit() or attributes.get('id') != int(id):
+                errors.append('{} has id {}'.format(id, attributes.get('id')))
+            
+            if 'imageId' not in attributes:
+                errors.append('{} has no imageId'.format(id))
+            
+            for key, value in loaded.get(id, {}).items():
+                if key not in attributes:
+                    errors.append('{} is missing {}'.format(id, key))
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    if not isinstance(attributes[key], (int, float)) or isinstance(attributes[key], bool):
+                        errors.append('{}.{} is not a number'.format(id, key))
+        
+        return errors
+    
+    def poll(self):
+        """ The changes waiting to be swapped in, or None
+        """
+        with self.lock:
+            changes = self.pending
+            self.pending = None
+        
+        if changes is not None:
+            self.reloads += 1
+        return changes
+    
+    def stop(self):
+        self.stopped.set()
+
+
+
+class FrameProfiler:
+    """ Per-phase frame timings with rolling histories, an on-screen overlay and cProfile captures
+    Game only calls into it behind a check of enabled, so it costs next to nothing while off
+    """
+    def __init__(self, profile=False, historyLength=300, captureLength=120):
+        """
+        profile: Time every frame from the start, like --profile, whether or not the overlay is shown
+        historyLength: Frames kept per phase for the percentiles
+        captureLength: Frames recorded by startCapture()
+        """
+        self.profile = profile
+        self.enabled = profile # Timing frames, for the overlay or because profile asked for it
+        self.overlay = False
+        self.overlaySurface = None
+        self.overlayInterval = 15 # Frames between re-rendering the overlay text
+        self.font = None
+        self.historyLength = historyLength
+        self.histories = OrderedDict() # phase: deque of milliseconds per frame
+        self.frameTotals = defaultdict(float) # phase: seconds so far this frame
+        self.counters = {}
+        self.frames = 0
+        self.local = threading.local() # lastMark per thread, so a pipelined simulation's marks don't cut into drawing's
+        self.captureLength = captureLength
+        self.capture = None # cProfile.Profile while capturing
+        self.captureFramesLeft = 0
+    
+    def mark(self, phase):
+        # Charges the time since this thread's previous mark to phase
+        now = time.perf_counter()
+        local = self.local
+        self.frameTotals[phase] += now - getattr(local, 'lastMark', now)
+        local.lastMark = now
+    
+    def resetMark(self):
+        # Starts this thread's next phase now
+        self.local.lastMark = time.perf_counter()
+    
+    def beginFrame(self):
+        if self.capture is not None:
+            self.capture.enable()
+        
+        self.resetMark()
+    
+    def endFrame(self, counters):
+        if self.capture is not None:
+            self.capture.disable()
+            self.captureFramesLeft -= 1
+            
+            if self.captureFramesLeft <= 0:
+                self.stopCapture()
+        
+        if not self.enabled:
+            return
+        
+        frameTime = 0
+        for phase, seconds in self.frameTotals.items():
+            history = self.histories.get(phase)
+            if history is None:
+                history = self.histories[phase] = deque(maxlen=self.historyLength)
+            
+            history.append(seconds * 1000)
+            frameTime += seconds
+        
+        history = self.histories.get('frame')
+        if history is None:
+            history = self.histories['frame'] = deque(maxlen=self.historyLength)
+        history.append(frameTime * 1000)
+        
+        self.frameTotals.clear()
+        self.counters = counters
+        self.frames += 1
+    
+    def getSummary(self):
+        """ phase: (p50, p95, max) in milliseconds over the kept history
+        """
+        summary = OrderedDict()
+        
+        for phase, history in self.histories.items():
+            samples = sorted(history)
+            count = len(samples)
+            summary[phase] = (samples[count // 2], samples[min(count - 1, int(count * 0.95))], samples[-1])
+        
+        return summary
+    
+    def toggleOverlay(self):
+        self.overlay = not self.overlay
+        self.enabled = self.overlay or self.profile
+        
+        if not self.enabled:
+            self.histories.clear()
+            self.frameTotals.clear()
+    
+    def renderOverlay(self):
+        if self.font is None:
+            self.font = AssetManager.getFont(18)
+        
+        lines = ['{:<30} p50 {:6.2f}  p95 {:6.2f}  max {:6.2f}'.format(phase, *times) for phase, times in self.getSummary().items()]
+        lines.extend('{:<30} {}'.format(name, value) for name, value in self.counters.items())
+        lines.append('F3: overlay  F4: capture {} frames'.format(self.captureLength))
+        
+        lineHeight = self.font.get_linesize()
+        surface = pygame.Surface((360, lineHeight * len(lines) + 8))
+        surface.fill((0, 0, 0))
+        
+        for i, line in enumerate(lines):
+            surface.blit(self.font.render(line, 1, (255, 255, 255)), (4, 4 + i * lineHeight))
+        
+        self.overlaySurface = surface
+    
+    def getOverlay(self):
+        # Re-rendering the text is the expensive part, so only do it every few frames
+        if self.overlaySurface is None or self.frames % self.overlayInterval == 0:
+            self.renderOverlay()
+        
+        return self.overlaySurface
+    
+    def startCapture(self, frames=None):
+        """ Records the next frames with cProfile, then dumps them to a .pstats file
+        """
+        if self.capture is not None:
+            return
+        
+        self.captureFramesLeft = frames or self.captureLength
+        self.capture = cProfile.Profile()
+        log.info('profiler', 'FrameProfiler: Capturing {} frames', self.captureFramesLeft)
+    
+    def stopCapture(self):
+        fileName = 'profile-{}.pstats'.format(time.strftime('%Y%m%d-%H%M%S'))
+        
+        try:
+            self.capture.dump_stats(fileName)
+            log.info('profiler', 'FrameProfiler: Wrote {}', fileName)
+        except IOError as e:
+            log.error('profiler', 'FrameProfiler: stopCapture: Error writing {}: {}', fileName, e)
+        
+        self.capture = None
+
+
+
+class Compositor:
+    """ Draws all sprites with batched Surface.blits calls and pushes one display update per frame
+    Overlapping dirty rects are merged, and past fullUpdateThreshold of the screen it just flips
+    """
+    def __init__(self, fullUpdateThreshold=0.5):
+        """
+        fullUpdateThreshold: Share of the screen area that's dirty before a full flip is cheaper
+        """
+        self.fullUpdateThreshold = fullUpdateThreshold
+        self.previousRects = [] # Drawn last frame, cleared this frame
+        self.fullUpdates = 0
+        self.partialUpdates = 0
+    
+    @staticmethod
+    def blitSprites(surface, sprites):
+        """ Blits sprites batched by image, returns the rects drawn to
+        """
+        return Compositor.blitBatched(surface, [(sprite.image, sprite.rect) for sprite in sprites])
+    
+    @staticmethod
+    def blitBatched(surface, blits):
+        """ Blits (image, rect) pairs batched by image, so identical sprites go out back to back in one blits call
+        Returns the rects drawn to
+        """
+        batches = {}
+        
+        for blit in blits:
+            batch = batches.get(id(blit[0]))
+            
+            if batch is None:
+                batches[id(blit[0])] = [blit]
+            else:
+                batch.append(blit)
+        
+        sequence = []
+        for batch in batches.values():
+            sequence.extend(batch)
+        
+        return surface.blits(sequence)
+    
+    def draw(self, screen, background, layers, overlays=(), redraw=False):
+        """ Clears last frame's sprites, draws this frame's and returns every dirty rect
+        layers: Lists of (image, rect) drawn back to front, each batched by image on its own
+        overlays: (surface, position) drawn on top, ie. the profiler overlay
+        redraw: The background changed, so it's blitted whole instead of just under last frame's sprites
+        """
+        clearRects = self.previousRects
+        
+        if redraw:
+            clearRects = [screen.blit(background, (0, 0))]
+        elif clearRects:
+            screen.blits([(background, rect, rect) for rect in clearRects], 0)
+        
+        rects = []
+        for blits in layers:
+            rects.extend(self.blitBatched(screen, blits))
+        
+        for surface, position in overlays:
+            rects.append(screen.blit(surface, position))
+        
+        self.previousRects = rects
+        return clearRects + rects
+    
+    def present(self, dirty, screenArea):
+        """ Pushes the frame to the display and returns the number of rects updated
+        """
+        dirtyArea = 0
+        for rect in dirty:
+            dirtyArea += rect.w * rect.h
+        
+        if dirtyArea > screenArea * self.fullUpdateThreshold:
+            pygame.display.flip()
+            self.fullUpdates += 1
+            return 1
+        
+        merged = self.mergeRects(dirty)
+        pygame.display.update(merged)
+        self.partialUpdates += 1
+        return len(merged)
+    
+    @staticmethod
+    def mergeRects(rects):
+        """ Unions overlapping rects until none of the results overlap
+        """
+        merged = []
+        
+        for rect in rects:
+            if not rect.w or not rect.h:
+                continue
+            
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            
+            merged.append(rect)
+        
+        return merged
+
+
+
+class BackdropLayer:
+    """ One layer behind the Actors, rendered once into its own surface, scrolling ones wrap around
+    """
+    def __init__(self, surface, velocity=(0, 0)):
+        """
+        velocity: Pixels per reference tick, far parallax layers are the slow ones
+        """
+        self.surface = surface
+        self.velocity = velocity
+        self.offset = (0, 0) # Whole pixel offset the layer was last drawn at
+        self.area = None # Part of a static layer that isn't transparent, ie. just the title, see crop
+    
+    def crop(self):
+        # Static layers are only ever drawn at (0, 0), so only the pixels they cover need blitting
+        self.area = self.surface.get_bounding_rect()
+    
+    def scrolls(self):
+        return bool(self.velocity[0] or self.velocity[1])
+    
+    def scroll(self, ticks):
+        """ Moves to where the layer is after ticks reference ticks, returns whether that's a new pixel offset
+        """
+        if not self.scrolls():
+            return False
+        
+        width, height = self.surface.get_size()
+        offset = (int(self.velocity[0] * ticks) % width, int(self.velocity[1] * ticks) % height)
+        
+        if offset == self.offset:
+            return False
+        
+        self.offset = offset
+        return True
+    
+    def draw(self, target):
+        x, y = self.offset
+        
+        if self.area is not None:
+            target.blit(self.surface, self.area.topleft, self.area)
+            return
+        
+        if not x and not y:
+            target.blit(self.surface, (0, 0))
+            return
+        
+        # Tiled so the part scrolled off one edge comes back in on the other
+        width, height = self.surface.get_size()
+        target.blits([(self.surface, (x - dx, y - dy)) for dx in (0, width) for dy in (0, height)], 0)
+
+
+
+class Backdrop:
+    """ The layers behind the Actors composited into one cached surface, ie. the background, the title
+    and far parallax layers. It's only recomposited when a layer scrolls onto a new pixel, every other
+    frame the Compositor just clears the sprites from it
+    Static layers are flattened when it's built: the ones below every scrolling layer into one opaque base,
+    and each run of them between or above scrolling layers into one surface cropped to what it covers, so
+    recompositing blits the base, the scrolling layers, and only the covered part of those runs
+    """
+    def __init__(self, size, layers):
+        """
+        layers: BackdropLayers, back to front
+        """
+        self.base = pygame.Surface(size).convert()
+        self.base.fill((0, 0, 0))
+        self.layers = [] # Above base, back to front: scrolling layers, and static ones flattened per run
+        run = None # The flattened static layer the next static one goes into
+        
+        for layer in layers:
+            if layer is None:
+                continue
+            
+            if layer.scrolls():
+                self.layers.append(layer)
+                run = None
+            elif not self.layers:
+                layer.draw(self.base)
+            elif run is None:
+                run = layer # Kept as it is until a second static layer has to be flattened into it
+                flattened = False
+                self.layers.append(run)
+            else:
+                if not flattened:
+                    surface = pygame.Surface(size, SRCALPHA).convert_alpha()
+                    surface.fill((0, 0, 0, 0))
+                    run.draw(surface)
+                    run = BackdropLayer(surface)
+                    flattened = True
+                    self.layers[-1] = run
+                
+                layer.draw(run.surface)
+        
+        for layer in self.layers:
+            if not layer.scrolls():
+                layer.crop()
+        
+        self.surface = pygame.Surface(size).convert()
+        self.compositions = 0
+        self.compose()
+    
+    def update(self, ticks):
+        """ Scrolls every layer to where it is after ticks reference ticks, returns whether the surface changed
+        """
+        changed = False
+        
+        for layer in self.layers:
+            if layer.scroll(ticks):
+                changed = True
+        
+        if changed:
+            self.compose()
+        
+        return changed
+    
+    def compose(self):
+        self.surface.blit(self.base, (0, 0))
+        
+        for layer in self.layers:
+            layer.draw(self.surface)
+        
+        self.compositions += 1
+    
+    @staticmethod
+    def createLayer(size, layer):
+        """ Pre-renders a layer dict from scenarios.json, None if it can't be
+        layer: type 'fill' (color), 'text' (text, size, color, top) or 'stars' (count, color, radius, seed),
+            any of them with a velocity to scroll at
+        """
+        try:
+            kind = layer['type']
+            color = layer.get('color', (255, 255, 255))
+            
+            if kind == 'fill':
+                surface = pygame.Surface(size).convert()
+                surface.fill(color)
+            elif kind == 'text':
+                surface = pygame.Surface(size, SRCALPHA).convert_alpha()
+                surface.fill((0, 0, 0, 0))
+                
+                font = AssetManager.getFont(layer.get('size', 36))
+                
+                if font is not None:
+                    text = font.render(layer['text'], 1, color)
+                    surface.blit(text, text.get_rect(centerx=size[0] / 2, top=layer.get('top', 0)))
+            elif kind == 'stars':
+                surface = pygame.Surface(size, SRCALPHA).convert_alpha()
+                surface.fill((0, 0, 0, 0))
+                starRandom = random.Random(layer.get('seed', 0)) # Its own, drawing mustn't move the Game's random state
+                radius = layer.get('radius', 1)
+                
+                for i in range(layer.get('count', 100)):
+                    position = (starRandom.randrange(size[0]), starRandom.randrange(size[1]))
+                    pygame.draw.circle(surface, color, position, radius)
+            else:
+                raise ValueError('Unknown layer type {}'.format(kind))
+            
+            return BackdropLayer(surface, tuple(layer.get('velocity', (0, 0))))
+        except BaseException as e:
+            log.error('game', 'Backdrop: createLayer: Error creating layer {}: {}', layer, e)
+            return None
+
+
+
+class DepthBuckets:
+    """ Actors grouped by z into depth bands that are drawn back to front. An Actor only changes band
+    when its z crosses into another, so drawing in depth order needs no per frame sort
+    """
+    def __init__(self, bandDepth=10):
+        """
+        bandDepth: z covered by each band, matches the objects' zDepth
+        """
+        self.bandDepth = bandDepth
+        self.bands = {} # band: {Actor: None}, dicts as insertion ordered sets
+        self.order = [] # Bands back to front, only inserted into when a new band is first used
+    
+    def add(self, actor):
+        z = actor.attribute.z
+        band = int(z // self.bandDepth)
+        actor.depthZ = z
+        actor.depthBand = band
+        members = self.bands.get(band)
+        
+        if members is None:
+            members = self.bands[band] = {}
+            bisect.insort(self.order, band)
+        
+        members[actor] = None
+    
+    def remove(self, actor):
+        if actor.depthBand is not None:
+            del self.bands[actor.depthBand][actor]
+            actor.depthBand = None
+    
+    def move(self, actor):
+        """ Rebands an Actor whose z changed, a no-op unless it crossed into another band
+        """
+        z = actor.attribute.z
+        
+        if int(z // self.bandDepth) == actor.depthBand:
+            actor.depthZ = z
+        else:
+            self.remove(actor)
+            self.add(actor)
+    
+    def getLayers(self):
+        """ (image, rect) of the visible Actors of each band, back to front
+        """
+        bands = self.bands
+        return [[(actor.image, actor.rect) for actor in bands[band] if actor.visible] for band in self.order if bands[band]]
+
+
+
+class FrameBuffer:
+    """ What one frame draws, copied out of the Actors so it can be drawn while the simulation moves them on
+    """
+    def __init__(self):
+        self.layers = [] # Like DepthBuckets.getLayers, but with rects of their own
+        self.tickCount = 0
+    
+    def capture(self, game, alpha=None):
+        """ Copies every visible Actor's image and rect, moved alpha of the way from the previous tick if it's awake
+        """
+        depths = game.depths
+        bands = depths.bands
+        layers = self.layers
+        del layers[:]
+        
+        for band in depths.order:
+            blits = []
+            
+            for actor in bands[band]:
+                if actor.visible:
+                    rect = actor.rect.copy()
+                    
+                    if alpha is not None and actor.awakeIndex is not None:
+                        actor.interpolateRect(alpha, rect)
+                    
+                    blits.append((actor.image, rect))
+            
+            if blits:
+                layers.append(blits)
+        
+        if game.projectiles is not None:
+            layers.append(game.projectiles.getBlits(game.screenRect, alpha))
+        
+        self.tickCount = game.tickCount
+
+
+
+class SimulationPipeline:
+    """ Simulates the next frame on a worker thread while the main thread draws the last one
+    The worker ticks, then captures the frame into the back FrameBuffer; the main thread waits for it and swaps
+    it to the front, so drawing only ever reads a frame the simulation is done with. pygame's blits and transforms
+    release the GIL, so on more than one core a frame costs about the longer of the two instead of their sum
+    Input reaches the screen a frame later than it does unpipelined
+    """
+    def __init__(self, game):
+        self.game = game
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='Simulation')
+        self.front = FrameBuffer() # Drawn by the main thread
+        self.back = FrameBuffer() # Captured into by the worker
+        self.future = None
+    
+    def start(self, ticks, events, keys, inputSource=None, alpha=None):
+        """ Runs ticks ticks on the worker, then captures them into the back buffer
+        inputSource: As for Game.run, called on the worker so it sees the tick it's asked for
+        alpha: Interpolation for the captured frame, see Game.drawOutput
+        """
+        self.future = self.executor.submit(self.simulate, ticks, events, keys, inputSource, alpha)
+    
+    def simulate(self, ticks, events, keys, inputSource, alpha):
+        game = self.game
+        
+        if game.profiler.enabled:
+            game.profiler.resetMark()
+        
+        for i in range(ticks):
+            if inputSource is not None:
+                tickInput = inputSource(game.tickCount)
+                
+                if tickInput is None:
+                    game.exit = True # Seen by the main thread once it has drawn this frame
+                    break
+                
+                events, keys = tickInput
+            
+            game.tick(events, keys)
+            events = [] # Events are only handled by the first tick of the frame
+        
+        self.back.capture(game, alpha)
+    
+    def finish(self):
+        """ Waits for the worker, swaps what it captured to the front and returns that
+        Re-raises anything the simulation raised
+        """
+        future = self.future
+        
+        if future is not None:
+            self.future = None
+            future.result()
+            self.front, self.back = self.back, self.front
+        
+        return self.front
+    
+    def stop(self):
+        try:
+            self.finish()
+        finally:
+            self.executor.shutdown()
+
+
+
+class ActorPool:
+    """ Destroyed Actors kept per type so createActor can respawn them instead of building new ones
+    """
+    def __init__(self):
+        self.freeActors = defaultdict(list) # id: destroyed Actors of that type
+        self.liveCount = defaultdict(int)
+        self.highWaterMark = defaultdict(int) # id: most Actors of that type alive at once
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+    
+    def acquire(self, id):
+        """ A destroyed Actor of type id, or None if the caller has to create one
+        """
+        freeActors = self.freeActors[id]
+        
+        if freeActors:
+            actor = freeActors.pop()
+            self.reused += 1
+        else:
+            actor = None
+            self.created += 1
+        
+        self.liveCount[id] += 1
+        if self.liveCount[id] > self.highWaterMark[id]:
+            self.highWaterMark[id] = self.liveCount[id]
+        
+        return actor
+    
+    def release(self, actor):
+        id = actor.template.id
+        self.liveCount[id] -= 1
+        self.released += 1
+        self.freeActors[id].append(actor)
+    
+    def getStats(self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'highWaterMark': dict(self.highWaterMark),
+            'free': dict((id, len(actors)) for id, actors in self.freeActors.items()),
+        }
+
+
+
+class WaveSpawner:
+    """ Spawns a scenario's waves into the game with Game.spawnBatch as their ticks come up
+    A wave is a dict from scenarios.json:
+        tick: Reference ticks after the stage starts, repeat and interval spawn it again every interval ticks
+        name, id, count: What to spawn and how many
+        formation: 'line', 'grid', 'circle' or 'random', laid out from origin using spacing,
+            columns, radius or area
+        z, r, momentum: Starting z, rotation and [xs, ys, zs, rs], spread randomly varies momentum
+        faceOutwards: For circles, rotate each Actor to face away from the centre
+    """
+    def __init__(self, game, waves, startTick):
+        self.game = game
+        self.random = game.random # Seeded, so spawns replay exactly
+        self.pending = [] # (tick, wave), soonest last
+        
+        for wave in waves:
+            for i in range(wave.get('repeat', 1)):
+                self.pending.append((startTick + game.getTicks(wave.get('tick', 0) + i * wave.get('interval', 0)), wave))
+        
+        self.pending.sort(key=lambda pending: pending[0], reverse=True)
+        self.schedule = tuple(self.pending) # Everything, pending is always the start of it
+        self.spawned = 0
+    
+    def update(self, tickCount):
+        while self.pending and self.pending[-1][0] <= tickCount:
+            tick, wave = self.pending.pop()
+            coords, momenta = self.getFormation(wave)
+            self.game.spawnBatch(wave['name'], wave['id'], coords, momenta)
+            self.spawned += len(coords)
+    
+    def getFormation(self, wave):
+        count = wave['count']
+        x, y = wave.get('origin', (0, 0))
+        z = wave.get('z', 0)
+        r = wave.get('r', 0)
+        formation = wave.get('formation', 'line')
+        spacingX, spacingY = wave.get('spacing', (0, 0))
+        coords = []
+        
+        for i in range(count):
+            if formation == 'grid':
+                columns = wave.get('columns', 10)
+                coords.append([x + (i % columns) * spacingX, y + (i // columns) * spacingY, z, r])
+            elif formation == 'circle':
+                angle = 2 * math.pi * i / count
+                dx = math.cos(angle)
+                dy = math.sin(angle)
+                rotation = math.degrees(math.atan2(-dx, -dy)) if wave.get('faceOutwards') else r # See Actor.thrust
+                coords.append([x + dx * wave.get('radius', 0), y + dy * wave.get('radius', 0), z, rotation])
+            elif formation == 'random':
+                width, height = wave.get('area', (self.game.screenWidth, self.game.screenHeight))
+                coords.append([x + self.random.uniform(0, width), y + self.random.uniform(0, height), z, r])
+            else:
+                coords.append([x + i * spacingX, y + i * spacingY, z, r])
+        
+        momentum = wave.get('momentum', (0, 0, 0, 0))
+        spread = wave.get('spread')
+        
+        if spread is None:
+            momenta = [list(momentum) for i in range(count)]
+        else:
+            uniform = self.random.uniform
+            momenta = [[momentum[axis] + uniform(-spread[axis], spread[axis]) for axis in range(4)] for i in range(count)]
+        
+        return coords, momenta
+
+
+
+class CollisionSystem:
+    """ Spatial hash broadphase for Actor collisions
+    Every tick the targets are hashed into a uniform grid, and each primed Actor with a
+    collidesWith list is only tested against targets in the cells its rect touches
+    """
+    def __init__(self, cellSize=64, masks=None):
+        """
+        masks: MaskCache for a pixel-accurate narrowphase after the rect test, None for rects only
+        """
+        self.cellSize = cellSize
+        self.masks = masks
+        self.grid = defaultdict(list) # (cellX, cellY): Actors whose rect touches the cell
+        self.pairsTested = 0 # Stats for the last tick
+        self.pairsFound = 0
+        self.maskRejects = 0 # Rect overlaps the masks showed weren't hits
+    
+    def getCells(self, rect):
+        cellSize = self.cellSize
+        
+        for cellX in range(rect.left // cellSize, (rect.right - 1) // cellSize + 1):
+            for cellY in range(rect.top // cellSize, (rect.bottom - 1) // cellSize + 1):
+                yield (cellX, cellY)
+    
+    def build(self, actors, layers):
+        self.grid.clear()
+        
+        for actor in actors:
+            if actor.template.collisionLayer in layers:
+                for cell in self.getCells(actor.rect):
+                    self.grid[cell].append(actor)
+    
+    def findPairs(self, actors):
+        """ Returns every (attacker, target) pair whose rects overlap, whose z-depths overlap,
+        and where the target's collisionLayer is in the attacker's collidesWith
+        """
+        attackers = [actor for actor in actors if actor.canCollide()]
+        pairs = []
+        masks = self.masks
+        self.pairsTested = 0
+        self.maskRejects = 0
+        
+        if not attackers:
+            self.pairsFound = 0
+            return pairs
+        
+        layers = set()
+        for attacker in attackers:
+            layers.update(attacker.template.collidesWith)
+        
+        self.build(actors, layers)
+        
+        for attacker in attackers:
+            rect = attacker.rect
+            z = attacker.attribute.z
+            zDepth = attacker.template.zDepth
+            collidesWith = attacker.template.collidesWith
+            tested = set()
+            
+            for cell in self.getCells(rect):
+                for target in self.grid.get(cell, ()):
+                    if target is attacker or target in tested:
+                        continue
+                    
+                    tested.add(target)
+                    self.pairsTested += 1
+                    
+                    if target.template.collisionLayer not in collidesWith:
+                        continue
+                    
+                    # Z-Level collision, the two Actors' depths have to overlap
+                    if abs(target.attribute.z - z) > (target.template.zDepth + zDepth) / 2:
+                        continue
+                    
+                    if rect.colliderect(target.rect):
+                        if masks is not None and not masks.overlap(attacker, target):
+                            self.maskRejects += 1
+                            continue
+                        
+                        pairs.append((attacker, target))
+        
+        self.pairsFound = len(pairs)
+        return pairs
+    
+    def resolve(self, actors, projectiles=None):
+        """ Finds this tick's pairs, buffers the damage they do, then applies it once per target
+        projectiles: A ProjectileBuffer whose projectiles hit the Actors too
+        """
+        damage = {} # Target: total damage, in the order they were first hit
+        
+        for attacker, target in self.findPairs(actors):
+            if attacker.attribute.hp > 0: # Spent bullets don't keep hitting
+                amount = attacker.hit(target)
+                
+                if amount:
+                    damage[target] = damage.get(target, 0) + amount
+        
+        if projectiles is not None and projectiles.count:
+            self.resolveProjectiles(projectiles, actors, damage)
+        
+        for target, amount in damage.items():
+            target.takeDamage(amount)
+    
+    def resolveProjectiles(self, projectiles, actors, damage):
+        """ Hits the primed projectiles against the Actors in their collidesWith layers, a cell at a time
+        The projectiles are sorted by the cell their top-left is in, and each cell's are tested against all
+        its targets in one NumPy comparison. A projectile hits the first target it overlaps, like a bullet
+        Actor with hp 1 does, and its damage is added to damage
+        """
+        n = projectiles.count
+        c = dict((field, column[:n]) for field, column in projectiles.columns.items())
+        ready = (c['primerTicks'] <= 0) & (c['hp'] > 0)
+        cellSize = self.cellSize
+        cellKey = 1 << 20 # Cell (x, y) is x * cellKey + y
+        
+        for typeIndex, template in enumerate(projectiles.templates):
+            rows = numpy.flatnonzero(ready & (c['type'] == typeIndex))
+            
+            if not len(rows):
+                continue
+            
+            targets = [actor for actor in actors
+                if actor.template.collisionLayer in template.collidesWith and actor.template.damagable == True]
+            
+            if not targets:
+                continue
+            
+            # Targets are hashed into every cell a projectile overlapping them could have its top-left in
+            maxWidth = int(c['w'][rows].max())
+            maxHeight = int(c['h'][rows].max())
+            grid = defaultdict(list)
+            
+            for target in targets:
+                rect = target.rect
+                
+                for cellX in range((rect.left - maxWidth) // cellSize, (rect.right - 1) // cellSize + 1):
+                    for cellY in range((rect.top - maxHeight) // cellSize, (rect.bottom - 1) // cellSize + 1):
+                        grid[cellX * cellKey + cellY].append(target)
+            
+            keys = (c['x'][rows] // cellSize).astype(numpy.int64) * cellKey + (c['y'][rows] // cellSize).astype(numpy.int64)
+            order = numpy.argsort(keys, kind='stable')
+            rows = rows[order]
+            cellKeys, starts = numpy.unique(keys[order], return_index=True)
+            ends = numpy.append(starts[1:], len(rows))
+            zDepth = template.zDepth
+            amount = template.damage
+            
+            for key, start, end in zip(cellKeys.tolist(), starts.tolist(), ends.tolist()):
+                cellTargets = grid.get(key)
+                
+                if cellTargets is None:
+                    continue
+                
+                cellRows = rows[start:end]
+                left = numpy.array([target.rect.left for target in cellTargets])
+                top = numpy.array([target.rect.top for target in cellTargets])
+                right = numpy.array([target.rect.right for target in cellTargets])
+                bottom = numpy.array([target.rect.bottom for target in cellTargets])
+                z = numpy.array([target.attribute.z for target in cellTargets])
+                depth = numpy.array([target.template.zDepth for target in cellTargets])
+                actorNum = numpy.array([target.actorNum for target in cellTargets])
+                x = c['x'][cellRows, None]
+                y = c['y'][cellRows, None]
+                
+                # Rect overlap, then z-depth overlap as in findPairs, and never the owner
+                overlap = ((x < right) & (x + c['w'][cellRows, None] > left) & (y < bottom) & (y + c['h'][cellRows, None] > top)
+                    & (numpy.abs(z - c['z'][cellRows, None]) <= (depth + zDepth) / 2) & (c['owner'][cellRows, None] != actorNum))
+                self.pairsTested += overlap.size
+                hits = numpy.flatnonzero(overlap.any(axis=1))
+                
+                if not len(hits):
+                    continue
+                
+                first = overlap[hits].argmax(axis=1)
+                c['hp'][cellRows[hits]] -= 1
+                
+                for index in first.tolist():
+                    target = cellTargets[index]
+                    damage[target] = damage.get(target, 0) + amount
+                
+                self.pairsFound += len(hits)
+
+
+
+class TransformCache:
+    """ Shared LRU cache of rotozoomed images, keyed by imageId and quantised rotation and scale
+    Identical Actors facing roughly the same way share one image instead of each rotozooming their own
+    """
+    def __init__(self, rotationStep=1, scaleStep=0.02, memoryBudget=64 * 1024 * 1024):
+        """
+        rotationStep: Degrees per rotation bucket, should divide 360
+        scaleStep: Scale per scale bucket
+        memoryBudget: Bytes of cached images kept before the least recently used are evicted
+        """
+        self.rotationStep = rotationStep
+        self.rotationBuckets = int(round(360 / rotationStep))
+        self.scaleStep = scaleStep
+        self.memoryBudget = memoryBudget
+        self.memoryUsed = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def key(self, imageId, r, s):
+        return (imageId, int(round(r / self.rotationStep)) % self.rotationBuckets, int(round(s / self.scaleStep)))
+    
+    def get(self, key, baseImage):
+        """ Returns the cached image for key, rotozooming baseImage on a miss
+        """
+        image = self.entries.get(key)
+        
+        if image is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return image
+        
+        self.misses += 1
+        image = self.transform(key, baseImage)
+        self.entries[key] = image
+        self.memoryUsed += self.imageBytes(image)
+        
+        while self.memoryUsed > self.memoryBudget and len(self.entries) > 1:
+            oldKey, oldImage = self.entries.popitem(last=False)
+            self.memoryUsed -= self.imageBytes(oldImage)
+            self.evictions += 1
+        
+        return image
+    
+    def transform(self, key, baseImage):
+        # Rotozooms to the centre of key's buckets, without caching it
+        return pygame.transform.rotozoom(baseImage, key[1] * self.rotationStep, key[2] * self.scaleStep)
+    
+    def prewarm(self, imageId, baseImage, s=1):
+        # Every rotation bucket at one scale, which is what most Actors use most of the time
+        for bucket in range(self.rotationBuckets):
+            self.get(self.key(imageId, bucket * self.rotationStep, s), baseImage)
+    
+    @staticmethod
+    def imageBytes(image):
+        return image.get_width() * image.get_height() * image.get_bytesize()
+
+
+
+class MaskCache:
+    """ Shared LRU cache of pygame masks for the narrowphase, keyed like TransformCache so Actors
+    drawing the same cached image share its mask, and a mask is only built the first time it's needed
+    """
+    def __init__(self, memoryBudget=16 * 1024 * 1024):
+        """
+        memoryBudget: Bytes of cached masks kept before the least recently used are evicted
+        """
+        self.memoryBudget = memoryBudget
+        self.memoryUsed = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, actor):
+        """ The mask of the image actor is drawn with
+        """
+        if actor.attachmentList:
+            # Attachments make the image the Actor's own, so is its mask. Actor.updateImage builds it with the image,
+            # it's only built here for an Actor that hasn't been drawn since it got its attachments
+            if actor.mask is None or actor.maskKey != actor.transformKey:
+                self.build(actor)
+            return actor.mask
+        
+        key = actor.transformKey or (actor.template.imageId, None, None) # Not transformed yet
+        mask = self.entries.get(key)
+        
+        if mask is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return mask
+        
+        self.misses += 1
+        return self.add(key, actor.image)
+    
+    def build(self, actor):
+        # The mask of an Actor's own composite image, kept on the Actor rather than shared
+        actor.mask = pygame.mask.from_surface(actor.image)
+        actor.maskKey = actor.transformKey
+    
+    def add(self, key, image):
+        mask = pygame.mask.from_surface(image)
+        self.entries[key] = mask
+        self.memoryUsed += self.maskBytes(mask)
+        
+        while self.memoryUsed > self.memoryBudget and len(self.entries) > 1:
+            oldKey, oldMask = self.entries.popitem(last=False)
+            self.memoryUsed -= self.maskBytes(oldMask)
+            self.evictions += 1
+        
+        return mask
+    
+    def prewarm(self, transforms):
+        # A mask for every image already in the TransformCache
+        for key, image in transforms.entries.items():
+            if key not in self.entries:
+                self.add(key, image)
+    
+    def overlap(self, attacker, target):
+        """ Whether the two Actors' drawn pixels overlap, for pairs whose rects already do
+        """
+        offset = (target.rect.x - attacker.rect.x, target.rect.y - attacker.rect.y)
+        return self.get(attacker).overlap(self.get(target), offset) is not None
+    
+    @staticmethod
+    def maskBytes(mask):
+        width, height = mask.get_size()
+        return width * height // 8
+
+
+
+class PhysicsWorld:
+    """ Structure-of-arrays store for the movement state of every live Actor
+    step() does what Actor.updatePhysics does, for all rows in one batched NumPy pass
+    """
+    # Attributes kept in the arrays, the rest of an Actor's changing state stays in its PhysicsActorState's slots
+    # and its static attributes in the shared ActorTemplate
+    fields = (
+        'x', 'y', 'z', 'r', 's', 'xs', 'ys', 'zs', 'rs', 'engineSpeed',
+        'xMax', 'xMin', 'yMax', 'yMin', 'sMax', 'sMin', 'rMax', 'rMin',
+        'xsMax', 'xsMin', 'ysMax', 'ysMin', 'rsMax', 'rsMin',
+        'xFricCoef', 'yFricCoef', 'zFricCoef', 'rFricCoef',
+    )
+    
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.count = 0 # Rows handed out so far, the arrays are only stepped up to here
+        self.freeRows = []
+        self.columns = {}
+        
+        for field in self.fields:
+            self.columns[field] = numpy.zeros(capacity)
+    
+    def grow(self):
+        self.capacity *= 2
+        
+        for field in self.fields:
+            column = numpy.zeros(self.capacity)
+            column[:self.count] = self.columns[field][:self.count]
+            self.columns[field] = column
+    
+    def reserve(self, rows):
+        # Grows once up front for a batch of Actors instead of doubling part way through
+        needed = self.count + rows - len(self.freeRows)
+        
+        while self.capacity < needed:
+            self.grow()
+    
+    def allocate(self, attribute):
+        """ Copies an Actor's physics attributes into a free row and returns the row
+        """
+        if self.freeRows:
+            row = self.freeRows.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow()
+            row = self.count
+            self.count += 1
+        
+        for field in self.fields:
+            self.columns[field][row] = attribute[field]
+        
+        return row
+    
+    def allocateBatch(self, attribute, coords, momenta=None):
+        """ allocate for a wave of Actors of one type, written a column at a time instead of a row at a time
+        The rows also get their coords and momenta, so the Actors don't set them one by one
+        Returns the rows, in the order of coords
+        """
+        if not coords:
+            return []
+        
+        self.reserve(len(coords))
+        reused = min(len(coords), len(self.freeRows))
+        rows = [self.freeRows.pop() for i in range(reused)] # In the order allocate would hand them out
+        rows.extend(range(self.count, self.count + len(coords) - reused))
+        self.count += len(coords) - reused
+        index = numpy.array(rows)
+        
+        for field in self.fields:
+            self.columns[field][index] = attribute[field]
+        
+        placed = [(('x', 'y', 'z', 'r'), coords)]
         
-        if self.attribute['y'] > (game.screenHeight + self.attribute['yDestroyMax']) or self.attribute['y'] < self.attribute['yDestroyMin']:
-            self.destruct()
+        if momenta is not None:
+            placed.append((('xs', 'ys', 'zs', 'rs'), momenta))
         
-        if self.attribute['z'] > self.attribute['zDestroyMax'] or self.attribute['z'] < self.attribute['zDestroyMin']:
-            self.destruct()
+        for fields, values in placed:
+            values = numpy.array(values, dtype=float)
             
-        if self.attribute['hp'] <= 0:
-            # play explode sprite
-            self.destruct()
+            for i, field in enumerate(fields):
+                self.columns[field][index] = values[:, i]
+        
+        return rows
     
-    def takeDamage(self, damage):
-        if self.attribute['damagable'] == True:
-            self.attribute['hp'] -= damage
-            print("takeDamage: {} taking {} damage, hp: {}".format(self.attribute['name'], damage, self.attribute['hp']))
-            return True
-        else:
-            return False
+    def release(self, row):
+        # Dead rows keep being stepped until reused, which is cheaper than masking them out
+        self.freeRows.append(row)
     
-    def destruct(self):
-        self.removeAttachments()
-        game.deleteActor(self)
-        # Python should remove the object once there are no more references to it
+    def setLimits(self, row, attribute):
+        """ Copies a reloaded template's static attributes into a live row, leaving its movement state
+        """
+        for field in self.fields:
+            if field not in ActorState.fieldSet:
+                self.columns[field][row] = attribute[field]
+    
+    def step(self, screenWidth, screenHeight, stepScale=1.0):
+        """
+        stepScale: Game.stepScale, speeds and accelerations are per reference tick
+        """
+        n = self.count
+        c = dict((field, column[:n]) for field, column in self.columns.items())
+        where = numpy.where
         
-    def detectCollisions(self):
-        # TODO: Z-Level collision detection
-        if self.attribute['primerTicks'] > 0:
-            self.attribute['primerTicks'] -= 1
-        else:
-            if self.attribute['name'] == 'bullet': # Debug: if bullet
-                collideList = self.rect.collidelist(game.allSprites)
-                print("Collision Detection: {} {} with {}".format(self.attribute['name'], self.actorIndex, collideList))
+        # Friction, see Actor.updateFriction
+        for speed, coef in (('xs', 'xFricCoef'), ('ys', 'yFricCoef'), ('zs', 'zFricCoef'), ('rs', 'rFricCoef')):
+            s = c[speed]
+            friction = c[coef] * stepScale
+            s[:] = where(s > 0, numpy.maximum(s - friction, 0), where(s < 0, numpy.minimum(s + friction, 0), 0))
+        
+        # Engine, see Actor.runEngine and Actor.thrust
+        radR = numpy.radians(c['r'])
+        c['xs'] += c['engineSpeed'] * numpy.sin(radR) * -1 * stepScale
+        c['ys'] += c['engineSpeed'] * numpy.cos(radR) * -1 * stepScale
+        
+        # Speed and boundary clamping, see Actor.updateX and Actor.updateY
+        for axis, screenSize in (('x', screenWidth), ('y', screenHeight)):
+            speed = c[axis + 's']
+            speed[:] = self.clamp(speed, c[axis + 'sMin'], c[axis + 'sMax'])
+            c[axis][:] = self.clamp(c[axis] + speed * stepScale, c[axis + 'Min'], c[axis + 'Max'] + screenSize)
+        
+        # Scaling, see Actor.updateScale
+        s = c['s']
+        inRange = (s <= c['sMax']) & (s >= c['sMin'])
+        s[:] = where(inRange, self.clamp(s + c['zs'] / 100 * stepScale, c['sMin'], c['sMax']), s)
+        
+        # Rotation and wraparound, see Actor.updateRotation
+        r = c['r']
+        rs = c['rs']
+        inRange = (r <= c['rMax']) & (r >= c['rMin'])
+        rs[:] = where(inRange, self.clamp(rs, c['rsMin'], c['rsMax']), rs)
+        newRot = self.clamp(r + rs * stepScale, c['rMin'], c['rMax'])
+        newRot = where((newRot == c['rMax']) | (newRot == c['rMin']), 0, newRot)
+        r[:] = where(inRange, newRot, r)
+    
+    @staticmethod
+    def clamp(value, minimum, maximum):
+        # Maximum is checked first to match the if/elif chains in Actor
+        return numpy.where(value > maximum, maximum, numpy.where(value < minimum, minimum, value))
+
+
+
+class ProjectileBuffer:
+    """ Structure-of-arrays store for every live projectile, what guns fire into instead of an Actor per bullet
+    A projectile only keeps what a bullet needs: position, velocity, heading, ttl, hits left and its owner.
+    Everything else comes from its type's template. step() ages, culls and moves them all in one batched
+    NumPy pass, CollisionSystem.resolveProjectiles hits them against the Actors, and getBlits draws them
+    from one shared image per type and rotation bucket
+    """
+    fields = (
+        ('type', 'i'), ('owner', 'q'), ('image', 'i'), ('x', 'd'), ('y', 'd'), ('z', 'd'), ('xs', 'd'), ('ys', 'd'),
+        ('heading', 'd'), ('dirX', 'd'), ('dirY', 'd'), ('w', 'd'), ('h', 'd'), ('ttl', 'd'), ('primerTicks', 'd'),
+        ('hp', 'd'), ('previousX', 'd'), ('previousY', 'd'),
+    )
+    # Per type, from its template
+    constantFields = (
+        'engineSpeed', 'xFricCoef', 'yFricCoef', 'xsMax', 'xsMin', 'ysMax', 'ysMin', 'damage', 'zDepth',
+        'xDestroyMax', 'xDestroyMin', 'yDestroyMax', 'yDestroyMin',
+    )
+    
+    def __init__(self, transforms, assets, getTicks, capacity=256):
+        """
+        transforms: The Game's TransformCache, the rotated images are taken from it once and then kept here
+        getTicks: Game.getTicks, for the template's ttl and primerTicks at the Game's tick rate
+        """
+        self.transforms = transforms
+        self.assets = assets
+        self.getTicks = getTicks
+        self.capacity = capacity
+        self.count = 0 # Live projectiles, always the first rows
+        self.columns = {}
+        
+        for field, typecode in self.fields:
+            self.columns[field] = numpy.zeros(capacity, dtype=numpy.int64 if typecode in 'iq' else numpy.float64)
+        
+        self.templates = [] # Type index: ActorTemplate
+        self.typeIndex = {} # Template id: type index
+        self.constants = dict((field, numpy.zeros(0)) for field in self.constantFields)
+        self.images = [] # Image index: rotated image, shared by every projectile of that type facing that way
+        self.imageIndex = {} # TransformCache key: image index
+        self.spawned = 0
+        self.culled = 0
+    
+    def grow(self):
+        self.capacity *= 2
+        
+        for field, column in self.columns.items():
+            grown = numpy.zeros(self.capacity, dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            self.columns[field] = grown
+    
+    def getType(self, template):
+        index = self.typeIndex.get(template.id)
+        
+        if index is None:
+            index = self.typeIndex[template.id] = len(self.templates)
+            self.templates.append(template)
+            self.compileConstants()
+        
+        return index
+    
+    def setTemplates(self, templates):
+        """ Swaps in reloaded templates, live projectiles of those types carry on with the new constants
+        templates: {id: ActorTemplate}
+        """
+        for id, template in templates.items():
+            if id in self.typeIndex:
+                self.templates[self.typeIndex[id]] = template
+        
+        self.compileConstants()
+    
+    def compileConstants(self):
+        for field in self.constantFields:
+            self.constants[field] = numpy.array([getattr(template, field) for template in self.templates], dtype=numpy.float64)
+    
+    def getImage(self, template, heading):
+        key = self.transforms.key(template.imageId, heading, 1)
+        index = self.imageIndex.get(key)
+        
+        if index is None:
+            index = self.imageIndex[key] = len(self.images)
+            self.images.append(self.transforms.get(key, self.assets.getImage(template.imageId)))
+        
+        return index
+    
+    def spawn(self, template, x, y, z, heading, xs, ys, owner, ttl=None):
+        """ Adds a projectile of template's type at top-left x, y, facing heading
+        owner: actorNum of the Actor that fired it, it can't hit its owner
+        ttl: Ticks it lives for, instead of its type's ttl. It lives until it's out of bounds if neither has one
+        """
+        if self.count == self.capacity:
+            self.grow()
+        
+        row = self.count
+        self.count += 1
+        self.spawned += 1
+        image = self.getImage(template, heading)
+        width, height = self.images[image].get_size()
+        radR = math.radians(heading)
+        
+        if ttl is None:
+            ttl = self.getTicks(template.ttl) if 'ttl' in template.defaults else math.inf
+        
+        values = (
+            ('type', self.getType(template)), ('owner', owner), ('image', image), ('x', x), ('y', y), ('z', z),
+            ('xs', xs), ('ys', ys), ('heading', heading), ('dirX', -math.sin(radR)), ('dirY', -math.cos(radR)),
+            ('w', width), ('h', height), ('ttl', ttl), ('primerTicks', self.getTicks(template.primerTicks)),
+            ('hp', template.hp),
+            ('previousX', x), ('previousY', y),
+        )
+        
+        for field, value in values:
+            self.columns[field][row] = value
+    
+    def compact(self, keep):
+        """ Drops every row not in keep, the survivors stay in order so the world stays replayable
+        """
+        count = len(keep)
+        
+        if count == self.count:
+            return
+        
+        for column in self.columns.values():
+            column[:count] = column[keep]
+        
+        self.culled += self.count - count
+        self.count = count
+    
+    def step(self, screenWidth, screenHeight, stepScale=1.0):
+        """ Culls spent, expired and out of bounds projectiles, then moves the rest, like Actor.update does bullets
+        """
+        if not self.count:
+            return
+        
+        n = self.count
+        c = dict((field, column[:n]) for field, column in self.columns.items())
+        k = dict((field, constant[c['type']]) for field, constant in self.constants.items())
+        
+        # See Actor.checkDestroyConditions
+        alive = ((c['hp'] > 0) & (c['ttl'] > 0) & (c['x'] <= screenWidth + k['xDestroyMax']) & (c['x'] >= k['xDestroyMin'])
+            & (c['y'] <= screenHeight + k['yDestroyMax']) & (c['y'] >= k['yDestroyMin']))
+        
+        if not alive.all():
+            self.compact(numpy.flatnonzero(alive))
+            
+            if not self.count:
+                return
+            
+            n = self.count
+            c = dict((field, column[:n]) for field, column in self.columns.items())
+            k = dict((field, constant[c['type']]) for field, constant in self.constants.items())
+        
+        where = numpy.where
+        c['previousX'][:] = c['x']
+        c['previousY'][:] = c['y']
+        c['primerTicks'] -= 1 # Both were converted to this tick rate by spawn
+        c['ttl'] -= 1
+        
+        # Friction, then the engine along the heading, see PhysicsWorld.step
+        for speed, coef in (('xs', 'xFricCoef'), ('ys', 'yFricCoef')):
+            s = c[speed]
+            friction = k[coef] * stepScale
+            s[:] = where(s > 0, numpy.maximum(s - friction, 0), where(s < 0, numpy.minimum(s + friction, 0), 0))
+        
+        c['xs'] += k['engineSpeed'] * c['dirX'] * stepScale
+        c['ys'] += k['engineSpeed'] * c['dirY'] * stepScale
+        
+        for axis in ('x', 'y'):
+            speed = c[axis + 's']
+            speed[:] = PhysicsWorld.clamp(speed, k[axis + 'sMin'], k[axis + 'sMax'])
+            c[axis] += speed * stepScale
+    
+    def getBlits(self, screenRect, alpha=None):
+        """ (image, position) of every projectile on screen, alpha of the way from its previous tick's position
+        """
+        n = self.count
+        
+        if not n:
+            return []
+        
+        c = self.columns
+        x = c['x'][:n]
+        y = c['y'][:n]
+        
+        if alpha is not None:
+            previousX = c['previousX'][:n]
+            previousY = c['previousY'][:n]
+            x = previousX + (x - previousX) * alpha
+            y = previousY + (y - previousY) * alpha
+        
+        visible = ((x < screenRect.right) & (x + c['w'][:n] > screenRect.left) & (y < screenRect.bottom)
+            & (y + c['h'][:n] > screenRect.top))
+        rows = numpy.flatnonzero(visible)
+        images = self.images
+        return [(images[image], (px, py)) for image, px, py in zip(c['image'][rows].tolist(), x[rows].tolist(), y[rows].tolist())]
+    
+    def clear(self):
+        self.count = 0
+
+
+
+class WorldSnapshot:
+    """ Packs every live Actor's changing state into one fixed-layout binary buffer and back
+    The layout is a header, the Random state, then one column per field with a value for every
+    Actor in allSprites order, then the same for attachments. Columns are native byte order
+    arrays, so with a PhysicsWorld the movement fields are copied out of it in bulk, and the projectiles
+    are copied out of the ProjectileBuffer the same way
+    """
+    magic = b'OQSS'
+    version = 3
+    # magic, version, tickCount, actorNum, actors, attachments, projectiles, pending waves, spawned, gauss
+    header = struct.Struct('=4sHqqIIIII?d')
+    randomWords = 625 # Mersenne Twister state, see random.getstate()
+    actorColumns = (
+        ('actorNum', 'q'), ('id', 'i'), ('awakeIndex', 'i'), ('restTicks', 'i'), ('flags', 'b'), ('primerTicks', 'q'),
+        ('x', 'd'), ('y', 'd'), ('z', 'd'), ('r', 'd'), ('s', 'd'), ('xs', 'd'), ('ys', 'd'), ('zs', 'd'), ('rs', 'd'),
+        ('engineSpeed', 'd'), ('hp', 'd'), ('ttl', 'q'),
+    )
+    attachmentColumns = (('owner', 'i'), ('x', 'd'), ('y', 'd'), ('z', 'd'), ('r', 'd'), ('s', 'd'))
+    weaponColumns = (('readyTick', 'd'), ('burstLeft', 'i'), ('nextShotTick', 'd')) # Attachments' own, not attributes
+    # The image is worked out again from the type and heading, its index is only meaningful to one buffer
+    projectileColumns = (
+        ('id', 'i'), ('owner', 'q'), ('x', 'd'), ('y', 'd'), ('z', 'd'), ('xs', 'd'), ('ys', 'd'), ('heading', 'd'),
+        ('ttl', 'd'), ('primerTicks', 'd'), ('hp', 'd'), ('previousX', 'd'), ('previousY', 'd'),
+    )
+    visibleFlag = 1
+    playerFlag = 2
+    expiresFlag = 4
+    
+    @classmethod
+    def capture(cls, game):
+        """ Returns the world's state as bytes
+        """
+        actors = game.allSprites
+        count = len(actors)
+        states = [actor.attribute for actor in actors]
+        player = getattr(game, 'playerSprite', None)
+        randomVersion, randomState, gauss = game.random.getstate()
+        awakeIndexes = [-1] * count # Filled in from the awake list, which is shorter than allSprites
+        
+        for awakeIndex, actor in enumerate(game.awakeActors):
+            awakeIndexes[actor.actorIndex] = awakeIndex
+        
+        columns = {
+            'actorNum': map(attrgetter('actorNum'), actors),
+            'id': map(attrgetter('template.id'), actors),
+            'awakeIndex': awakeIndexes,
+            'restTicks': map(attrgetter('restTicks'), actors),
+            'flags': (actor.visible * cls.visibleFlag + (actor is player) * cls.playerFlag + actor.expires * cls.expiresFlag
+                for actor in actors),
+            'ttl': (actor.attribute.ttl if actor.expires else 0 for actor in actors), # Only set on Actors that expire
+        }
+        
+        if game.physics is not None and actors:
+            # Gathered straight out of the PhysicsWorld's arrays
+            rows = numpy.fromiter(map(attrgetter('physicsRow'), actors), dtype=numpy.intp, count=count)
+            
+            for field in ActorState.fields:
+                if field in PhysicsWorld.fields:
+                    columns[field] = game.physics.columns[field][rows]
+        
+        for name, typecode in cls.actorColumns:
+            if name not in columns:
+                columns[name] = map(attrgetter(name), states)
+        
+        attachments = {'owner': []}
+        for name, typecode in cls.attachmentColumns[1:] + cls.weaponColumns:
+            attachments[name] = []
+        
+        for index, actor in enumerate(actors):
+            for attachment in actor.attachmentList:
+                attachments['owner'].append(index)
                 
-                if collideList != self.actorIndex: # If doesn't collide with self
-                    if game.allSprites[collideList].takeDamage(self.attribute['damage']) == True:
-                        self.attribute['hp'] -= 1 # In effect, hp is the number of hits a bullet can do
+                for name, typecode in cls.attachmentColumns[1:]:
+                    attachments[name].append(getattr(attachment.attribute, name))
+                
+                for name, typecode in cls.weaponColumns:
+                    attachments[name].append(getattr(attachment, name))
+        
+        projectiles = game.projectiles
+        projectileCount = 0 if projectiles is None else projectiles.count
+        pending = game.spawner.pending
+        buffers = [
+            cls.header.pack(cls.magic, cls.version, game.tickCount, game.actorNum, count, len(attachments['owner']),
+                projectileCount, len(pending), game.spawner.spawned, gauss is not None, gauss or 0.0),
+            array('I', randomState).tobytes(),
+        ]
+        
+        for name, typecode in cls.actorColumns:
+            buffers.append(cls.packColumn(typecode, columns[name], count))
+        
+        for name, typecode in cls.attachmentColumns + cls.weaponColumns:
+            buffers.append(array(typecode, attachments[name]).tobytes())
+        
+        if projectileCount:
+            ids = numpy.array([template.id for template in projectiles.templates], dtype=numpy.int32)
+            
+            for name, typecode in cls.projectileColumns:
+                if name == 'id':
+                    column = ids[projectiles.columns['type'][:projectileCount]]
+                else:
+                    column = projectiles.columns[name][:projectileCount] # Already int64 or float64, like q and d
+                buffers.append(column.tobytes())
+        
+        return b''.join(buffers)
     
-    def update(self):
-        self.detectCollisions()
-        self.checkDestroyConditions()
-        self.updateFriction()
-        self.runEngine()
-        self.updateX(0)
-        self.updateY(0)
-        self.updateScale()
-        self.updateRotation(0)
-        self.updateRect()
-        self.updateAttachments()
-        self.drawAttachments()
-        self.image = pygame.transform.rotozoom(self.baseImage, self.attribute['r'], self.attribute['s'])
+    @staticmethod
+    def packColumn(typecode, values, count):
+        # values: An array from the PhysicsWorld, or an iterator over count values, read in one pass without a list
+        if numpy is None:
+            return array(typecode, values).tobytes()
+        
+        if not isinstance(values, numpy.ndarray):
+            values = numpy.fromiter(values, dtype=typecode, count=count)
+        return values.tobytes()
+    
+    @classmethod
+    def decode(cls, data):
+        """ Unpacks a snapshot into (header, actors, attachments, projectiles), the last three are dicts of
+        column name: array
+        """
+        view = memoryview(data)
+        
+        try:
+            (magic, version, tickCount, actorNum, actorCount, attachmentCount, projectileCount, pendingCount, spawned,
+                hasGauss, gauss) = cls.header.unpack_from(view, 0)
+        except struct.error as e:
+            raise ValueError('Truncated snapshot: {}'.format(e))
+        
+        if magic != cls.magic or version != cls.version:
+            raise ValueError('Not a version {} snapshot'.format(cls.version))
+        
+        header = {
+            'tickCount': tickCount,
+            'actorNum': actorNum,
+            'projectiles': projectileCount,
+            'pendingWaves': pendingCount,
+            'spawned': spawned,
+            'gauss': gauss if hasGauss else None,
+        }
+        offset = cls.header.size
+        header['random'], offset = cls.readColumn(view, offset, 'I', cls.randomWords)
+        actors = {}
+        attachments = {}
+        projectiles = {}
+        
+        for name, typecode in cls.actorColumns:
+            actors[name], offset = cls.readColumn(view, offset, typecode, actorCount)
+        
+        for name, typecode in cls.attachmentColumns + cls.weaponColumns:
+            attachments[name], offset = cls.readColumn(view, offset, typecode, attachmentCount)
+        
+        for name, typecode in cls.projectileColumns:
+            projectiles[name], offset = cls.readColumn(view, offset, typecode, projectileCount)
+        
+        return header, actors, attachments, projectiles
+    
+    @staticmethod
+    def readColumn(view, offset, typecode, count):
+        column = array(typecode)
+        end = offset + column.itemsize * count
+        
+        if end > len(view):
+            raise ValueError('Truncated snapshot')
+        
+        column.frombytes(view[offset:end])
+        return column, end
+    
+    @classmethod
+    def restore(cls, game, data):
+        """ Puts every live Actor back the way the snapshot has it, the world then carries on exactly as it did
+        from the tick it was captured at. Actors still alive since the capture are reused in place, only the
+        ones that died or were born since are created or destructed
+        """
+        header, columns, attachments, projectiles = cls.decode(data)
+        actorNums = columns['actorNum'].tolist()
+        ids = columns['id'].tolist()
+        flags = columns['flags'].tolist()
+        count = len(actorNums)
+        capturedIds = dict(zip(actorNums, ids))
+        game.compactActors() # So actorHandles only has live Actors
+        
+        for actor in game.allSprites:
+            if capturedIds.get(actor.actorNum) != actor.template.id:
+                actor.destruct() # Back to the pool, so the ones created below reuse them
+        
+        game.compactActors()
+        
+        game.tickCount = header['tickCount']
+        game.random.setstate((3, tuple(header['random']), header['gauss']))
+        game.spawner.pending = list(game.spawner.schedule[:header['pendingWaves']])
+        game.spawner.spawned = header['spawned']
+        
+        if game.physics is not None:
+            game.physics.reserve(count - len(game.allSprites))
+        
+        actors = []
+        
+        for i, actorNum in enumerate(actorNums):
+            actor = game.actorHandles.get(actorNum)
+            
+            if actor is None:
+                template = game.getTemplate(ids[i])
+                name = 'player' if flags[i] & cls.playerFlag else getattr(template, 'name', 'actor')
+                game.actorNum = actorNum
+                coord = [columns['x'][i], columns['y'][i], columns['z'][i], columns['r'][i]]
+                momentum = [columns['xs'][i], columns['ys'][i], columns['zs'][i], columns['rs'][i]]
+                actor = game.getActor(game.createActor(name, template.id, coord, momentum))
+            elif flags[i] & cls.playerFlag:
+                game.playerSprite = actor
+            
+            actors.append(actor)
+        
+        game.actorNum = header['actorNum']
+        game.allSprites[:] = actors # Collisions are resolved in this order, so it's the captured one
+        
+        for actorIndex, actor in enumerate(actors):
+            actor.actorIndex = actorIndex
+        
+        # The state is written a column at a time, the movement fields straight into the PhysicsWorld's arrays
+        movement = [field for field in ActorState.fields if field in PhysicsWorld.fields]
+        states = [actor.attribute for actor in actors]
         
+        if game.physics is not None and actors:
+            rows = numpy.fromiter(map(attrgetter('physicsRow'), actors), dtype=numpy.intp, count=count)
+            
+            for field in movement:
+                game.physics.columns[field][rows] = numpy.frombuffer(columns[field], dtype=numpy.float64)
+            movement = []
+        
+        for field in movement + ['hp', 'primerTicks']:
+            for state, value in zip(states, columns[field].tolist()):
+                setattr(state, field, value)
+        
+        for actor, flag, ttl, restTicks in zip(actors, flags, columns['ttl'].tolist(), columns['restTicks'].tolist()):
+            actor.expires = bool(flag & cls.expiresFlag)
+            
+            if actor.expires:
+                actor.attribute.ttl = ttl
+            actor.restTicks = restTicks
+            actor.visible = bool(flag & cls.visibleFlag)
+            actor.awakeIndex = None
+            actor.firing = 0
+        
+        # Update order matters for replaying exactly, so the awake list keeps its captured order
+        awakeActors = sorted((awakeIndex, i) for i, awakeIndex in enumerate(columns['awakeIndex'].tolist()) if awakeIndex >= 0)
+        game.awakeActors = [actors[i] for awakeIndex, i in awakeActors]
+        
+        for awakeIndex, actor in enumerate(game.awakeActors):
+            actor.awakeIndex = awakeIndex
+        
+        slots = [0] * count
+        game.firingCount = 0 # Recounted from the attachments' bursts
+        
+        for j, owner in enumerate(attachments['owner']):
+            attachment = actors[owner].attachmentList[slots[owner]]
+            slots[owner] += 1
+            
+            for name, typecode in cls.attachmentColumns[1:]:
+                setattr(attachment.attribute, name, attachments[name][j])
+            
+            for name, typecode in cls.weaponColumns:
+                setattr(attachment, name, attachments[name][j])
+            
+            if attachment.burstLeft:
+                actors[owner].firing += 1
+                game.firingCount += 1
+            
+            # Not setLocalTransform, that would wake Actors the snapshot has asleep
+            attachment.rect.topleft = (attachment.attribute.x, attachment.attribute.y)
+            attachment.dirty = True
+            actors[owner].compositeDirty = True
+        
+        for actor, x, y, z in zip(actors, columns['x'].tolist(), columns['y'].tolist(), columns['z'].tolist()):
+            # updateRect from the columns, a rect only follows its coordinates from its next updateOutput,
+            # which sleeping Actors skip
+            actor.rect.x = x
+            actor.rect.y = y
+            actor.previousPosition = actor.rect.topleft
+            
+            if z != actor.depthZ:
+                game.depths.move(actor)
+            
+            if actor.visible:
+                if actor.compositeDirty:
+                    actor.updateComposite()
+                
+                actor.updateImage()
+        
+        if game.projectiles is not None:
+            game.projectiles.clear()
+            
+            for i in range(header['projectiles']):
+                game.projectiles.spawn(game.getTemplate(projectiles['id'][i]), projectiles['x'][i], projectiles['y'][i],
+                    projectiles['z'][i], projectiles['heading'][i], projectiles['xs'][i], projectiles['ys'][i],
+                    projectiles['owner'][i])
+            
+            for name in ('ttl', 'primerTicks', 'hp', 'previousX', 'previousY'):
+                game.projectiles.columns[name][:header['projectiles']] = projectiles[name]
+        elif header['projectiles']:
+            log.warning('game', 'WorldSnapshot: restore: Dropping {} projectiles, this Game has no ProjectileBuffer',
+                header['projectiles'])
+    
+    @classmethod
+    def compare(cls, first, second):
+        """ Where two snapshots differ, for finding the tick and Actor two runs desync at
+        Returns [(actorNum, field, first value, second value)], actorNum is None for the header
+        """
+        differences = []
+        firstHeader, firstActors, firstAttachments, firstProjectiles = cls.decode(first)
+        secondHeader, secondActors, secondAttachments, secondProjectiles = cls.decode(second)
+        
+        for key in firstHeader:
+            if firstHeader[key] != secondHeader[key]:
+                differences.append((None, key, firstHeader[key], secondHeader[key]))
+        
+        firstRows = dict((actorNum, i) for i, actorNum in enumerate(firstActors['actorNum']))
+        secondRows = dict((actorNum, i) for i, actorNum in enumerate(secondActors['actorNum']))
+        
+        for actorNum in sorted(set(firstRows) | set(secondRows)):
+            if actorNum not in firstRows or actorNum not in secondRows:
+                differences.append((actorNum, 'alive', actorNum in firstRows, actorNum in secondRows))
+                continue
+            
+            for name, typecode in cls.actorColumns[1:]:
+                firstValue = firstActors[name][firstRows[actorNum]]
+                secondValue = secondActors[name][secondRows[actorNum]]
+                
+                if firstValue != secondValue:
+                    differences.append((actorNum, name, firstValue, secondValue))
+        
+        return differences
+
+
+
+class RewindBuffer:
+    """ Ring buffer of the last capacity ticks' WorldSnapshots, for rewinding and desync debugging
+    """
+    def __init__(self, capacity=600):
+        self.snapshots = deque(maxlen=capacity) # (tickCount, snapshot), newest last
+    
+    def record(self, game):
+        # Anything from this tick on was rewound past, so it's replaced
+        while self.snapshots and self.snapshots[-1][0] >= game.tickCount:
+            self.snapshots.pop()
         
+        self.snapshots.append((game.tickCount, WorldSnapshot.capture(game)))
+    
+    def get(self, tick):
+        for snapshotTick, snapshot in reversed(self.snapshots):
+            if snapshotTick == tick:
+                return snapshot
+        return None
+    
+    def rewind(self, game, ticks):
+        """ Restores the world to how it was ticks ago, or as far back as the buffer goes
+        Returns the tick it rewound to, None if the buffer is empty
+        """
+        if not self.snapshots:
+            return None
+        
+        target = max(game.tickCount - ticks, self.snapshots[0][0])
+        
+        while len(self.snapshots) > 1 and self.snapshots[-1][0] > target:
+            self.snapshots.pop()
+        
+        tick, snapshot = self.snapshots[-1]
+        WorldSnapshot.restore(game, snapshot)
+        log.info('game', 'Rewound to tick {}', tick)
+        return tick
+
+
+
+class ActorTemplate:
+    """ The static attributes of one objects.json type, compiled once at load and shared by every
+    Actor of that type. Read them as attributes, ie. template.xsMax
+    """
+    def __init__(self, attributes):
+        defaults = {}
+        
+        for key, value in attributes.items():
+            if isinstance(value, list):
+                value = tuple(value) # Shared between Actors, so nothing in here may be mutable
+            defaults[key] = value
+            object.__setattr__(self, key, value)
+        
+        object.__setattr__(self, 'defaults', MappingProxyType(defaults))
+    
+    def __setattr__(self, key, value):
+        raise AttributeError('ActorTemplate is shared and immutable, set {} on the Actor\'s attribute instead'.format(key))
+
+
+
+class ActorState(MutableMapping):
+    """ The attributes of one Actor that change during play, kept in __slots__
+    It's also Actor.attribute, so attribute['key'] still works for every key: static ones are
+    read through to the ActorTemplate and can't be written, keys the template doesn't have are kept per Actor
+    """
+    fields = ('x', 'y', 'z', 'r', 's', 'xs', 'ys', 'zs', 'rs', 'engineSpeed', 'hp', 'primerTicks', 'ttl', 'image')
+    fieldSet = frozenset(fields)
+    slotFields = fields # The ones reset copies from the template, PhysicsActorState's row already has the rest
+    __slots__ = ('template', 'overrides') + fields
+    
+    def __init__(self, template):
+        self.template = template
+        self.reset()
+    
+    def reset(self):
+        # Back to the template's starting values, used when the Actor is respawned from the pool
+        self.overrides = None
+        defaults = self.template.defaults
+        
+        for field in self.slotFields:
+            if field in defaults:
+                setattr(self, field, defaults[field])
+    
+    def __getitem__(self, key):
+        if key in self.fieldSet:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        
+        if self.overrides is not None and key in self.overrides:
+            return self.overrides[key]
+        return self.template.defaults[key]
+    
+    def __setitem__(self, key, value):
+        if key in self.fieldSet:
+            setattr(self, key, value)
+        elif key in self.template.defaults:
+            # The hot paths read static attributes straight off the template, so a per-Actor copy would be ignored
+            raise TypeError('{} is shared by every Actor of type {}, change it in objects.json or with Game overrides'.format(
+                key, self.template.id))
+        else:
+            if self.overrides is None:
+                self.overrides = {}
+            self.overrides[key] = value
+    
+    def __delitem__(self, key):
+        if self.overrides is None or key not in self.overrides:
+            raise KeyError(key)
+        del self.overrides[key]
+    
+    def __iter__(self):
+        defaults = self.template.defaults
+        yield from defaults
+        
+        for field in self.fields:
+            if field not in defaults and hasattr(self, field):
+                yield field
+        
+        if self.overrides is not None:
+            for key in self.overrides:
+                if key not in defaults and key not in self.fieldSet:
+                    yield key
+    
+    def __len__(self):
+        return sum(1 for key in self)
+    
+    def copy(self):
+        return dict(self)
+
+
+
+class PhysicsActorState(ActorState):
+    """ ActorState whose movement fields live in a PhysicsWorld row instead of its slots
+    """
+    __slots__ = ('world', 'row')
+    
+    slotFields = tuple(field for field in ActorState.fields if field not in PhysicsWorld.fields)
+    
+    def __init__(self, template, world, row=None):
+        """
+        row: One PhysicsWorld.allocateBatch already filled in, otherwise one is allocated
+        """
+        self.world = world
+        self.row = world.allocate(template.defaults) if row is None else row
+        ActorState.__init__(self, template)
+
+
+def getPhysicsField(field):
+    def getField(self):
+        return self.world.columns[field].item(self.row)
+    
+    def setField(self, value):
+        self.world.columns[field][self.row] = value
+    
+    return property(getField, setField)
+
+
+for field in ActorState.fields:
+    if field in PhysicsWorld.fields:
+        setattr(PhysicsActorState, field, getPhysicsField(field))
+
+
 
 class ActorAttachment(pygame.sprite.Sprite):
     """ Class for an actor's items ie. weapons, cosmetic sprites
+    Its x, y, z, r and s are local to its parent: x and y place it on the parent's image, and
+    its world transform follows the parent's position, rotation and scale
     """
-    def __init__(self, id, name, coord=(0,0,0)):
+    def __init__(self, game, id, name, coord=(0,0,0), parent=None):
+        """
+        parent: The Actor, or ActorAttachment, this is attached to
+        """
+        self.game = game
+        self.parent = parent
+        self.dirty = True # Local transform changed since the world transform was worked out
+        self.parentTransform = None # Parent's world transform the cached one was worked out from
+        self.worldTransform = None
+        self.readyTick = 0 # Tick the trigger can next be pulled at, for weapons
+        self.burstLeft = 0 # Shots left in the current burst
+        self.nextShotTick = 0 # Tick the burst's next shot is due at
         pygame.sprite.Sprite.__init__(self) # Call sprite initialiser
         self.loadAttributes(id, name, coord)
         self.setImage()
         self.setRect()
-        print("Creating ActorAttachment")
+        log.debug('actor', 'Creating ActorAttachment {}', name)
     
     def setImage(self):
-        self.actorsImagePath = 'i/Actors'
         imageId = self.attribute['imageId']
-        self.attribute['image'] = '{}/{}.png'.format(self.actorsImagePath, imageId)
-        self.image = pygame.image.load(self.attribute['image']).convert_alpha()
+        self.attribute['image'] = self.game.assets.getImageFile(imageId)
+        self.image = self.game.assets.getImage(imageId) # Shared with every other Actor using this image
         self.baseImage = self.image
         self.surface = self.image
+        self.transformKey = None # Rotation and scale self.image was last transformed to
         
     def setRect(self):
         self.rect = self.surface.get_rect()
@@ -590,40 +4068,179 @@ class ActorAttachment(pygame.sprite.Sprite):
         self.rect.y = self.attribute['y']
     
     def loadAttributes(self, id, name, coord):
-        self.attribute = self.getAttributes(id)
+        self.template = self.game.getTemplate(id)
+        
+        if 'name' in self.template.defaults:
+            # The name is the attachment's own, ie. Actor.fire looks for 'gun', so the type can't set one for all of them
+            raise ValueError('ActorAttachment: loadAttributes: objects.json type {} has a name ({!r}), attachments '
+                'are named by createAttachment, remove it from the type'.format(id, self.template.name))
+        
+        self.attribute = ActorState(self.template)
         self.attribute['name'] = name
-        self.attribute['x'] = coord[0]
-        self.attribute['y'] = coord[1]
-        self.attribute['z'] = coord[2]
+        self.attribute.x = coord[0]
+        self.attribute.y = coord[1]
+        self.attribute.z = coord[2]
+        
+    def setTemplate(self, template):
+        imageChanged = template.imageId != self.template.imageId
+        self.template = template
+        self.attribute.template = template
+        
+        if imageChanged:
+            self.setImage()
+            self.rect.size = self.surface.get_size()
+            self.markDirty()
     
-    def getAttributes(self, id):
-        """ Gets properties from JSON file
+    def markDirty(self):
+        self.dirty = True
+        
+        if self.parent is not None:
+            self.parent.compositeDirty = True # The parent's cached composite has to be redrawn
+            self.parent.wake() # Even while it's resting
+    
+    def wake(self):
+        if self.parent is not None:
+            self.parent.wake()
+    
+    def setLocalTransform(self, x, y, z, r, s):
+        """ Moves, rotates or scales the attachment relative to its parent
+        """
+        state = self.attribute
+        state.x = x
+        state.y = y
+        state.z = z
+        state.r = r
+        state.s = s
+        self.rect.x = x
+        self.rect.y = y
+        self.markDirty()
+    
+    def getWorldTransform(self):
+        """ (x, y, z, r, s) of the attachment's centre in the world, only worked out again
+        after it or something it's attached to moved
         """
-        # Ideally we don't use game but some form of super() to access getAttributes
-        return game.getAttributes(id).copy() # Dicts are passed by reference
+        parentTransform = self.parent.getWorldTransform()
+        
+        if self.dirty or parentTransform != self.parentTransform:
+            parentX, parentY, parentZ, parentR, parentS = parentTransform
+            state = self.attribute
+            
+            # Offset of this centre from the parent's centre, on the parent's untransformed image
+            parentWidth, parentHeight = self.parent.getBaseSize()
+            dx = state.x + self.rect.width / 2 - parentWidth / 2
+            dy = state.y + self.rect.height / 2 - parentHeight / 2
+            
+            # pygame rotates anticlockwise, and y points down
+            radR = math.radians(parentR)
+            cosR = math.cos(radR)
+            sinR = math.sin(radR)
+            self.worldTransform = (
+                parentX + (dx * cosR + dy * sinR) * parentS,
+                parentY + (dy * cosR - dx * sinR) * parentS,
+                parentZ + state.z,
+                parentR + state.r,
+                parentS * state.s,
+            )
+            self.parentTransform = parentTransform
+            self.dirty = False
         
+        return self.worldTransform
+    
+    def getBaseSize(self):
+        return self.baseImage.get_size()
+    
     def getAttachmentAttribute(self):
         """ Getter for self.attribute
         """
         # TODO: Change the method name to avoid confusion
         return self.attribute
     
-    def fire(self, coord, momentum):
+    def getOwner(self):
+        # The Actor at the root of the attachments
+        owner = self.parent
+        
+        while isinstance(owner, ActorAttachment):
+            owner = owner.parent
+        
+        return owner
+    
+    def fire(self, momentum):
         """
         Pew pew pew
-        Bullet behaviour can be changed in objects.json
+        Pulls the trigger, which starts a burst unless the gun is still cooling down from the last one
+        The gun's cooldownTicks, burstCount, burstInterval, pellets, spread, jitter, muzzleSpeed,
+        projectileId and ttl, and the bullet's behaviour, can be changed in objects.json
+        Returns whether it fired
+        """
+        game = self.game
+        template = self.template
+        
+        if game.tickCount < self.readyTick:
+            return False
+        
+        self.readyTick = game.tickCount + game.getTicks(template.cooldownTicks)
+        self.nextShotTick = game.tickCount
+        
+        if not self.burstLeft:
+            self.getOwner().firing += 1
+            game.firingCount += 1
+        
+        self.burstLeft = template.burstCount
+        self.wake() # Firing Actors don't sleep until the burst is over
+        self.shoot(momentum)
+        return True
+    
+    def updateWeapon(self):
+        """ Fires the burst's shots that have come due, with the owner's momentum now
+        """
+        state = self.getOwner().attribute
+        
+        while self.burstLeft and self.game.tickCount >= self.nextShotTick:
+            self.shoot([state.xs, state.ys, state.zs, 0])
+    
+    def shoot(self, momentum):
+        """ One shot of the burst, pellets projectiles fanned across spread degrees
         """
-        # Implement fire rate
-        print('Firing bullet at coord: {} with momentum: {}'.format(coord, momentum))
-        coordOffset = [self.attribute['x'], self.attribute['y'], self.attribute['z'], self.attribute['r']]
-        coordOffset[0] = coordOffset[0] + coord[0] # X
-        coordOffset[1] = coordOffset[1] + coord[1] # Y
-        coordOffset[2] = coordOffset[2] + coord[2] # Z
-        coordOffset[3] = coord[3] # Rotation
+        game = self.game
+        template = self.template
+        owner = self.getOwner()
+        self.burstLeft -= 1
+        self.nextShotTick += game.getTicks(template.burstInterval)
+        
+        if not self.burstLeft:
+            owner.firing -= 1
+            game.firingCount -= 1
         
-        bulletType = 1 # Expand on this to include logic for picking appropriate bullet for gun type
+        # Centred on the gun wherever the parent has turned it, facing the way the parent faces
+        x, y, z, r, s = self.getWorldTransform()
+        projectile = game.getTemplate(template.projectileId)
+        bulletWidth, bulletHeight = game.assets.getImage(projectile.imageId).get_size()
+        pellets = template.pellets
+        ttl = game.getTicks(template.ttl) if 'ttl' in template.defaults else None # The gun's, over the bullet's own
         
-        game.createActor('bullet', bulletType, coordOffset, momentum)
+        for i in range(pellets):
+            heading = r
+            
+            if pellets > 1:
+                heading += template.spread * (i / (pellets - 1) - 0.5)
+            
+            if template.jitter:
+                heading += game.random.uniform(-template.jitter, template.jitter) # Seeded, so replays fire the same
+            
+            radR = math.radians(heading)
+            xs = momentum[0] - math.sin(radR) * template.muzzleSpeed
+            ys = momentum[1] - math.cos(radR) * template.muzzleSpeed
+            
+            if game.projectiles is not None:
+                game.projectiles.spawn(projectile, x - bulletWidth / 2, y - bulletHeight / 2, z, heading, xs, ys,
+                    owner.actorNum, ttl)
+            else:
+                coord = [x - bulletWidth / 2, y - bulletHeight / 2, z, heading]
+                log.debug('combat', 'Firing bullet at coord: {} with momentum: {}', coord, (xs, ys))
+                bullet = game.getActor(game.createActor('bullet', projectile.id, coord, [xs, ys, momentum[2], 0]))
+                
+                if ttl is not None:
+                    bullet.setLifetime(ttl)
     
     def rotate(self):
         pass
@@ -632,7 +4249,78 @@ class ActorAttachment(pygame.sprite.Sprite):
         pass
     
     def update(self):
-        self.image = pygame.transform.rotozoom(self.baseImage, self.attribute['r'], self.attribute['s'])
+        key = self.game.transforms.key(self.template.imageId, self.attribute.r, self.attribute.s)
+        
+        if self.transformKey != key:
+            self.transformKey = key
+            self.image = self.game.transforms.get(key, self.baseImage)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='OwlQuest: Sugoi Monogatari')
+    parser.add_argument('--vector-physics', action='store_true', help='Step movement in one batched NumPy pass')
+    parser.add_argument('--prewarm', action='store_true', help='Rotozoom every image at startup')
+    parser.add_argument('--preload', choices=('eager', 'background'), help='Load every image before it is first needed')
+    parser.add_argument('--headless', action='store_true', help='Run without a window as fast as possible')
+    parser.add_argument('--ticks', type=int, default=600, help='Ticks to run when headless')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', default='default', help='Scenario from data/scenarios.json to play')
+    parser.add_argument('--profile', action='store_true', help='Start with the frame profiler on')
+    parser.add_argument('--rewind', type=int, default=0, metavar='TICKS', help='Keep this many ticks to rewind with Backspace')
+    parser.add_argument('--tick-rate', type=int, default=60, help='Simulation ticks per second')
+    parser.add_argument('--frame-rate', type=int, default=60, help='Frames drawn per second at most')
+    parser.add_argument('--pacing', choices=('fixed', 'adaptive'), default='fixed',
+        help='adaptive drops frames under load and interpolates the rest')
+    parser.add_argument('--pixel-collisions', action='store_true', help='Test masks after rects before anything hits')
+    parser.add_argument('--watch', action='store_true', help='Hot-reload data/objects.json when it changes')
+    parser.add_argument('--pipelined', action='store_true', help='Simulate on a worker thread while the main thread draws')
+    parser.add_argument('--vector-projectiles', action='store_true',
+        help='Guns fire into a NumPy projectile buffer instead of spawning bullet Actors')
+    parser.add_argument('--no-cache', action='store_true', help='Read data/objects.json and the images directly, '
+        'instead of through data/cache/assets.bin')
+    parser.add_argument('--record', metavar='FILE', help='Record the session\'s input to this file')
+    parser.add_argument('--replay', metavar='FILE', help='Replay a recorded session, with its seed and scenario')
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--log-category', action='append', default=[], metavar='CATEGORY=LEVEL',
+        help='Level for one category, ie. combat=DEBUG')
+    parser.add_argument('--log-file', help='Also write the log to this file')
+    parser.add_argument('--log-json', action='store_true', help='Write the log file as JSON lines')
+    return parser.parse_args()
+
 
-game = Game()
-game.main()
\ No newline at end of file
+if __name__ == '__main__':
+    arguments = parseArguments()
+    log.configure(level=arguments.log_level, path=arguments.log_file, jsonLines=arguments.log_json,
+        categoryLevels=dict(category.split('=', 1) for category in arguments.log_category))
+    replay = None
+    
+    if arguments.replay:
+        replay = InputLog.load(arguments.replay)
+        arguments.seed = replay.seed
+        arguments.scenario = replay.scenario
+    
+    game = Game(vectorPhysics=arguments.vector_physics, prewarmTransforms=arguments.prewarm,
+        preloadAssets=arguments.preload, headless=arguments.headless, seed=arguments.seed, profile=arguments.profile,
+        scenario=arguments.scenario, rewindTicks=arguments.rewind, recordInput=bool(arguments.record),
+        tickRate=arguments.tick_rate, frameRate=arguments.frame_rate, pacing=arguments.pacing,
+        pixelCollisions=arguments.pixel_collisions, watchAttributes=arguments.watch,
+        assetCache=not arguments.no_cache, pipelined=arguments.pipelined, vectorProjectiles=arguments.vector_projectiles)
+    
+    if arguments.headless:
+        startTime = time.perf_counter()
+        
+        if replay is None:
+            game.run(arguments.ticks)
+        else:
+            game.run(len(replay), replay.getInput) # As fast as possible, for timing a real session
+        
+        log.flush()
+        print('Ran {} ticks in {:.3f}s'.format(game.tickCount, time.perf_counter() - startTime))
+        
+        for phase, times in game.profiler.getSummary().items():
+            print('{:<30} p50 {:.3f}ms p95 {:.3f}ms max {:.3f}ms'.format(phase, *times))
+    else:
+        game.main(None if replay is None else replay.getInput)
+    
+    if arguments.record:
+        game.inputLog.save(arguments.record)